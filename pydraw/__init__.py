@@ -24,15 +24,26 @@ Main features include:
   - polygons
   - bezier curves
 - drawings uses antialising (smooth sub-pixel precision)
+- optional supersampled antialiasing, eg 4x4 or 8x8 samples per pixel, chosen per image
+- optional gamma-correct blending in linear light, chosen per image
 - offers exact and fuzzy floodfill coloring of large areas (however, fuzzy floodfill is currently way too slow to be used)
 - can also transform images
   - perspective transform, ie 3d tilting of an image
   - sphere/stereographic transform, ie 3d globe effect (partially working, partially not)
+- very large images can be drawn on through a memory-mapped file with the MappedImage class
+- draw calls can be recorded in a DisplayList and replayed onto many images, or drawn in parallel tiles with drawtiled
+- rendered map tiles can be cached in memory and on disk with the TileCache class
+- a local render server for JSON draw jobs can be run with "python -m pydraw.serve"
+- images can have transparency in RGBA mode, stored premultiplied for fast blending, and saved with it
+- shapes and pasted pixels can be blended with modes such as multiply, screen, darken and lighten, and the Porter-Duff operators
+- images can be pasted onto each other with an anchor, opacity and mask, copying whole rows at once
+- drawings can be split into layers with the LayeredImage class, each with its own opacity, visibility, order and blend mode, and only changed rows are flattened again
+- benchmarks of all primitives and codecs, with regression checks, can be run with "python -m pydraw.bench"
 
 The main backdraws currently are:
 
-- only support for reading/writing gif images, and if you use too many colors the gif image won't save
-- while transparent gif images can be read, transparency will not be saved (becomes black)
+- only support for reading/writing png, gif, bmp and ppm/pam images, gifs with too many colors are reduced to 256 colors when saved
+- transparency is only kept by images in RGBA mode, and gif images only store fully transparent or opaque pixels
 - not as fast as C-based libraries (on average 10x slower)
 - not a stable version yet, so several lacking features and errors (see Status below)
 
@@ -52,7 +63,7 @@ img.view()
 
 ## Requires:
 No dependencies; everything is written with the standard builtin Python library.
-This is mainly thanks to the basic read-write capabilities of the Tkinter PhotoImage class.
+Images are read and written with pure-Python codecs, and Tkinter is only used for viewing.
 Also tested to work on both Python 2.x and 3.x. 
 
 ## Status:
@@ -61,11 +72,8 @@ However, still in its most basic alpha-version, which means there may be many bu
 But most importantly it is lacking a few crucial drawing features,
 which will be added in the future, such as:
 
-- None of the primitives are being filled correctly (so drawing is limited to outlines)
 - Thick multilines and thick polygon outlines appear choppy, need to add smooth join rules
-- Lines need to be capped at their ends, with option for rounded caps
 - Need more basic image transforms, such as rotate and flip
-- Support for saving transparency, and drawing partially transparent colors
 - Support for various color formats besides RGB (such as hex or colornames)
 - And most importantly, more image formats
 
@@ -90,9 +98,11 @@ I welcome any efforts to contribute code, particularly for:
 
 """
 
-import core, coordinate_transformer
+import core, coordinate_transformer, tilecache, layers
 from core import *
 from coordinate_transformer import *
+from tilecache import *
+from layers import *
 
 
 
@@ -26,6 +26,8 @@ __version__ = "0.3"
 __about =  "bmp module, version %s, written by Paul McGuire, October, 2003, updated by Margus Laak, September, 2009" % __version__ 
 
 from math import ceil, hypot
+import struct
+from array import array
 
 
 def shortToString(i):
@@ -386,34 +388,30 @@ class BitMap(object):
 
   def _saveBitMapNoCompression( self ):
     line_padding = (4 - (self.wd % 4)) % 4
-    
     # write bitmap header
-    _bitmap = "BM"
-    _bitmap += longToString( 54 + self.ht*(self.wd*3 + line_padding) )   # DWORD size in bytes of the file
-    _bitmap += longToString( 0 )    # DWORD 0
-    _bitmap += longToString( 54  )
-    _bitmap += longToString( 40 )    # DWORD header size = 40
-    _bitmap += longToString( self.wd )    # DWORD image width
-    _bitmap += longToString( self.ht )    # DWORD image height
-    _bitmap += shortToString( 1 )    # WORD planes = 1
-    _bitmap += shortToString( 24 )    # WORD bits per pixel = 8
-    _bitmap += longToString( 0 )    # DWORD compression = 0
-    _bitmap += longToString( self.ht * (self.wd * 3 + line_padding) )    # DWORD sizeimage = size in bytes of the bitmap = width * height
-    _bitmap += longToString( 0 )    # DWORD horiz pixels per meter (?)
-    _bitmap += longToString( 0 )    # DWORD ver pixels per meter (?)
-    _bitmap += longToString( 0 )    # DWORD number of colors used = 256
-    _bitmap += longToString( 0 )    # DWORD number of "import colors = len( self.palette )
-
-    # write pixels
+    _bitmap = [ "BM" ]
+    _bitmap.append( longToString( 54 + self.ht*(self.wd*3 + line_padding) ) )   # DWORD size in bytes of the file
+    _bitmap.append( longToString( 0 ) )    # DWORD 0
+    _bitmap.append( longToString( 54  ) )
+    _bitmap.append( longToString( 40 ) )    # DWORD header size = 40
+    _bitmap.append( longToString( self.wd ) )    # DWORD image width
+    _bitmap.append( longToString( self.ht ) )    # DWORD image height
+    _bitmap.append( shortToString( 1 ) )    # WORD planes = 1
+    _bitmap.append( shortToString( 24 ) )    # WORD bits per pixel = 8
+    _bitmap.append( longToString( 0 ) )    # DWORD compression = 0
+    _bitmap.append( longToString( self.ht * (self.wd * 3 + line_padding) ) )    # DWORD sizeimage = size in bytes of the bitmap = width * height
+    _bitmap.append( longToString( 0 ) )    # DWORD horiz pixels per meter (?)
+    _bitmap.append( longToString( 0 ) )    # DWORD ver pixels per meter (?)
+    _bitmap.append( longToString( 0 ) )    # DWORD number of colors used = 256
+    _bitmap.append( longToString( 0 ) )    # DWORD number of "import colors = len( self.palette )
+    # write pixels, converting each palette entry only once
+    colors = [ long24ToString(c) for c in self.palette ]
+    padding = chr( 0 ) * line_padding
     self.bitarray.reverse()
     for row in self.bitarray:
-      for pixel in row:
-        c = self.palette[pixel]
-        _bitmap += long24ToString(c)
-      for i in range(line_padding):
-        _bitmap += chr( 0 )
-
-    return _bitmap
+      _bitmap.append( "".join( [ colors[pixel] for pixel in row ] ) )
+      _bitmap.append( padding )
+    return "".join( _bitmap )
 
     """
     f = file( filename, "wb" )
@@ -579,7 +577,6 @@ class BitMap(object):
     self.font = font_data
   
   def loadImage(self, image):
-    
     width = stringToLong(image, 0x12)
     height = stringToLong(image, 0x16)
     self.wd = width
@@ -588,48 +585,167 @@ class BitMap(object):
     self.fgcolor = 0
     self.palette = []
     self.currentPen = 0
-    
+    # palette positions by color, instead of searching the palette list
+    paletteIndex = {}
     bitarray = []
-    bitarray.append([])
-    
-    row_idx = 0
-    col_idx = 0
     idx_offset = stringToLong(image, 0xa)
-    idx = idx_offset
     line_padding = (4 - ( width % 4 ) ) % 4
     bytes_in_row = width*3 + line_padding
-    
-    while (idx+3) <= len(image):
-      if col_idx >= width:
-        # end of row, dismiss padding
-        row_idx += 1
-        idx += line_padding
-        col_idx = 0
+    for row_start in range(idx_offset, idx_offset + height*bytes_in_row, bytes_in_row):
+      row = []
+      for idx in range(row_start, row_start + width*3, 3):
         if idx + 3 > len(image):
           break
-        # add new row to image
-        bitarray.append([])
-       
-      c = Color(ord(image[idx+2]), ord(image[idx+1]), ord(image[idx]))
-      # register palette
-      colorNum = c.toLong()
-      try:
-        self.currentPen = self.palette.index(colorNum)
-      except ValueError:
-        if len( self.palette ) < 256 :
-          self.palette.append(colorNum)
-          self.currentPen = len( self.palette ) - 1
-        else:
-          self.currentPen = self.fgcolor
-      
-      bitarray[row_idx].append(self.currentPen)
-      idx += 3
-      col_idx += 1
-    
+        c = Color(ord(image[idx+2]), ord(image[idx+1]), ord(image[idx]))
+        # register palette
+        colorNum = c.toLong()
+        try:
+          self.currentPen = paletteIndex[colorNum]
+        except KeyError:
+          if len( self.palette ) < 256 :
+            self.palette.append(colorNum)
+            self.currentPen = paletteIndex[colorNum] = len( self.palette ) - 1
+          else:
+            self.currentPen = self.fgcolor
+        row.append(self.currentPen)
+      if not row:
+        break
+      bitarray.append(row)
     # this is it
     bitarray.reverse()
     self.bitarray = bitarray
-    
+
+
+class Error(Exception):
+  pass
+
+# masks of the red, green, blue and alpha bytes of 32 bit pixels
+_BGRA_MASKS = (0x00ff0000, 0x0000ff00, 0x000000ff, 0xff000000)
+
+class Writer(object):
+  """writes 24 bit RGB or 32 bit RGBA bitmap files from rows of flat pixel values"""
+
+  def __init__( self, width, height, alpha=False ):
+    self.width = width
+    self.height = height
+    self.alpha = alpha
+
+  def write( self, outfile, rows ):
+    """writes to a file object opened in binary mode, given an iterable
+    of rows of flat RGB values, or RGBA values if alpha is True"""
+    rows = list( rows )
+    if len( rows ) != self.height:
+      raise Error( "expected %d rows, got %d" % (self.height, len(rows)) )
+    for data in self.iterwrite( reversed( rows ) ):
+      outfile.write( data )
+
+  def iterwrite( self, rows, bandheight=64 ):
+    """generates the bytes of the file piece by piece, the headers first
+    and then the bytes of every bandheight rows, given an iterable of the
+    rows from the bottom of the image up, the order they are stored in"""
+    planes = 4 if self.alpha else 3
+    rowbytes = self.width * planes
+    line_padding = (4 - (rowbytes % 4)) % 4
+    imagesize = self.height * (rowbytes + line_padding)
+    if self.alpha:
+      # BITMAPV4HEADER with bitfields, the only header with an alpha mask
+      headersize = 108
+      info = struct.pack( '<IiiHHIIiiII4I4s36x3I', headersize, self.width, self.height,
+                          1, 32, 3, imagesize, 2835, 2835, 0, 0,
+                          _BGRA_MASKS[0], _BGRA_MASKS[1], _BGRA_MASKS[2], _BGRA_MASKS[3],
+                          "BGRs", 0, 0, 0 )
+    else:
+      headersize = 40
+      info = struct.pack( '<IiiHHIIiiII', headersize, self.width, self.height,
+                          1, 24, 0, imagesize, 2835, 2835, 0, 0 )
+    offset = 14 + headersize
+    header = struct.pack( '<2sIHHI', "BM", offset + imagesize, 0, 0, offset )
+    yield header + info
+    # the colors are stored in BGR(A) order
+    padding = array( 'B', [0] * line_padding )
+    band = array( 'B' )
+    nrows = 0
+    for row in rows:
+      row = array( 'B', row )
+      line = array( 'B', row )
+      line[0::planes] = row[2::planes]
+      line[2::planes] = row[0::planes]
+      band.extend( line )
+      band.extend( padding )
+      nrows += 1
+      if nrows % bandheight == 0:
+        yield band.tostring()
+        band = array( 'B' )
+    if len( band ):
+      yield band.tostring()
+    if nrows != self.height:
+      raise Error( "expected %d rows, got %d" % (self.height, nrows) )
+
+class Reader(object):
+  """reads 24 bit RGB and 32 bit RGB(A) bitmap files, from either a filename,
+  a file object opened in binary mode, or a string of bytes"""
+
+  def __init__( self, filename=None, file=None, bytes=None ):
+    if filename:
+      fileobj = open( filename, "rb" )
+      self.data = fileobj.read()
+      fileobj.close()
+    elif file:
+      self.data = file.read()
+    elif bytes is not None:
+      self.data = bytes
+    else:
+      raise TypeError( "expecting filename, file or bytes" )
+
+  def read( self ):
+    """returns (width, height, rows, metadata), with rows as arrays of flat
+    RGB values top to bottom, or RGBA values if the file has an alpha mask,
+    as told by the "alpha" entry of the metadata dictionary"""
+    data = self.data
+    if data[:2] != "BM":
+      raise Error( "not a BMP file" )
+    offset, headersize = struct.unpack( '<II', data[10:18] )
+    if headersize < 40:
+      raise Error( "unsupported BMP header of %d bytes" % headersize )
+    width, height, _, bitcount, compression = struct.unpack( '<iiHHI', data[18:34] )
+    if bitcount not in (24, 32):
+      raise Error( "only 24 and 32 bit BMP files are supported, not %d bit" % bitcount )
+    alpha = False
+    if compression == 3 and bitcount == 32:
+      # bitfields follow the basic header, also when it is only 40 bytes
+      masks = struct.unpack( '<4I', data[54:70] )
+      if headersize == 40:
+        masks = masks[:3] + (0,)
+      if tuple(masks[:3]) != _BGRA_MASKS[:3] or masks[3] not in (0, _BGRA_MASKS[3]):
+        raise Error( "unsupported BMP bitfields" )
+      alpha = masks[3] != 0
+    elif compression != 0:
+      raise Error( "compressed BMP files are not supported" )
+    # negative height means the rows are stored top-down
+    topdown = height < 0
+    height = abs( height )
+    planes = bitcount // 8
+    outplanes = 4 if alpha else 3
+    rowbytes = width * planes
+    stride = rowbytes + (4 - (rowbytes % 4)) % 4
+    pixels = array( 'B', data[offset:offset + stride*height] )
+    if len( pixels ) < stride*height:
+      raise Error( "BMP pixel data is too short" )
+    rows = []
+    for start in range(0, stride*height, stride):
+      line = pixels[start:start + rowbytes]
+      row = array( 'B', [0] ) * (width * outplanes)
+      row[0::outplanes] = line[2::planes]
+      row[1::outplanes] = line[1::planes]
+      row[2::outplanes] = line[0::planes]
+      if alpha:
+        row[3::4] = line[3::4]
+      rows.append( row )
+    if not topdown:
+      rows.reverse()
+    meta = dict( size=(width, height), alpha=alpha, bitdepth=bitcount )
+    return width, height, rows, meta
+
 if __name__ == "__main__":
   
   # set test to run
@@ -0,0 +1,410 @@
+# Pydraw submodule
+# GIF reader/writer in pure Python, no Tkinter needed
+
+"""
+Reads and writes GIF images without relying on the Tkinter PhotoImage,
+so it also works on machines without a display.
+
+Pixels are passed to and from this module as rows of flat RGB or RGBA
+values, like the "boxed row flat pixel" format of the png module:
+
+    [[R,G,B, R,G,B, ...],
+     [R,G,B, R,G,B, ...]]
+
+Only the first frame of animated GIFs is read. When writing, images
+with more than 256 colors (or 255 if there is transparency) are reduced
+to a palette with the median cut algorithm, and pixels with an alpha
+value below 128 are written as transparent.
+
+GIF specification: http://www.w3.org/Graphics/GIF/spec-gif89a.txt
+"""
+
+import struct
+from array import array
+
+
+__all__ = ['Reader', 'Writer', 'Error', 'quantize']
+
+
+#interlaced rows are stored in four passes of (startrow, rowstep)
+_interlacepasses = ((0,8),(4,8),(2,4),(1,2))
+
+#LZW codes are never more than 12 bits
+_maxcodes = 4096
+
+
+class Error(Exception):
+    pass
+
+
+#LZW COMPRESSION
+
+def lzw_encode(indices, mincodesize):
+    """
+    Compresses a sequence of palette indices (integers smaller than
+    2**mincodesize) with the variable code length LZW used by GIF,
+    and returns the compressed bytes as an array.
+    """
+    clearcode = 1 << mincodesize
+    endcode = clearcode + 1
+    out = array('B')
+    bitbuf = 0
+    nbits = 0
+    #each string in the table is keyed by the code of its prefix
+    #shifted up a byte plus its last index, so no strings are built
+    table = {}
+    codesize = mincodesize + 1
+    nextcode = endcode + 1
+    #start with a clear code
+    bitbuf |= clearcode << nbits
+    nbits += codesize
+    prefix = None
+    for index in indices:
+        if prefix is None:
+            prefix = index
+            continue
+        key = (prefix << 8) | index
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        #emit the longest known string
+        bitbuf |= prefix << nbits
+        nbits += codesize
+        while nbits >= 8:
+            out.append(bitbuf & 0xff)
+            bitbuf >>= 8
+            nbits -= 8
+        if nextcode == (1 << codesize) and codesize < 12:
+            codesize += 1
+        if nextcode < _maxcodes:
+            table[key] = nextcode
+            nextcode += 1
+        else:
+            #table is full, so start over
+            bitbuf |= clearcode << nbits
+            nbits += codesize
+            table = {}
+            codesize = mincodesize + 1
+            nextcode = endcode + 1
+        prefix = index
+    #flush what is left
+    if prefix is not None:
+        bitbuf |= prefix << nbits
+        nbits += codesize
+        if nextcode == (1 << codesize) and codesize < 12:
+            codesize += 1
+    bitbuf |= endcode << nbits
+    nbits += codesize
+    while nbits > 0:
+        out.append(bitbuf & 0xff)
+        bitbuf >>= 8
+        nbits -= 8
+    return out
+
+def lzw_decode(data, mincodesize):
+    """
+    Decompresses GIF LZW data (a string of the joined data sub-blocks)
+    and returns the palette indices as a string of bytes.
+    """
+    data = bytearray(data)
+    clearcode = 1 << mincodesize
+    endcode = clearcode + 1
+    #table of strings, the clear and end codes are just placeholders
+    basetable = [struct.pack('B', i) for i in range(clearcode)] + [None, None]
+    table = list(basetable)
+    codesize = mincodesize + 1
+    codemask = (1 << codesize) - 1
+    out = []
+    prev = None
+    bitbuf = 0
+    nbits = 0
+    pos = 0
+    datalen = len(data)
+    while True:
+        while nbits < codesize:
+            if pos >= datalen:
+                #data ended without an end code, which some encoders do
+                return b''.join(out)
+            bitbuf |= data[pos] << nbits
+            pos += 1
+            nbits += 8
+        code = bitbuf & codemask
+        bitbuf >>= codesize
+        nbits -= codesize
+        if code == clearcode:
+            table = list(basetable)
+            codesize = mincodesize + 1
+            codemask = (1 << codesize) - 1
+            prev = None
+            continue
+        if code == endcode:
+            break
+        if code < len(table):
+            entry = table[code]
+            if entry is None:
+                raise Error("invalid LZW code %d" % code)
+            if prev is not None and len(table) < _maxcodes:
+                table.append(prev + entry[:1])
+        elif code == len(table) and prev is not None:
+            #the code being defined by this very step
+            entry = prev + prev[:1]
+            table.append(entry)
+        else:
+            raise Error("invalid LZW code %d" % code)
+        out.append(entry)
+        prev = entry
+        if len(table) == codemask + 1 and codesize < 12:
+            codesize += 1
+            codemask = (1 << codesize) - 1
+    return b''.join(out)
+
+
+#COLOR QUANTIZATION
+
+def quantize(histogram, maxcolors=256):
+    """
+    Reduces the colors of a histogram dictionary, of RGB tuples to their
+    pixel count, to at most maxcolors with the median cut algorithm.
+    Returns the palette as a list of RGB tuples, and a dictionary
+    mapping each original color to its palette index.
+    """
+    colors = list(histogram)
+    if len(colors) <= maxcolors:
+        return colors, dict((color,i) for i,color in enumerate(colors))
+
+    def widest(box):
+        #the channel with the largest range, and that range
+        best = (-1,0)
+        for channel in (0,1,2):
+            values = [color[channel] for color in box]
+            spread = max(values) - min(values)
+            if spread > best[0]:
+                best = (spread,channel)
+        return best
+
+    boxes = [(widest(colors), colors)]
+    while len(boxes) < maxcolors:
+        #split the box with the widest channel
+        boxindex = max(range(len(boxes)), key=lambda i: boxes[i][0][0])
+        (spread,channel),box = boxes[boxindex]
+        if spread == 0:
+            #only single colors left
+            break
+        box = sorted(box, key=lambda color: color[channel])
+        #split at the weighted median, leaving both halves non-empty
+        half = sum([histogram[color] for color in box]) / 2.0
+        count = 0
+        for split,color in enumerate(box):
+            count += histogram[color]
+            if count >= half:
+                break
+        split = min(max(split, 1), len(box)-1)
+        lower,upper = box[:split],box[split:]
+        boxes[boxindex] = (widest(lower), lower)
+        boxes.append((widest(upper), upper))
+
+    #each box becomes the weighted average of its colors
+    palette = []
+    mapping = {}
+    for index,(_,box) in enumerate(boxes):
+        total = r = g = b = 0
+        for color in box:
+            count = histogram[color]
+            total += count
+            r += color[0]*count
+            g += color[1]*count
+            b += color[2]*count
+            mapping[color] = index
+        palette.append((int(round(r/float(total))), int(round(g/float(total))), int(round(b/float(total)))))
+    return palette, mapping
+
+
+#WRITING
+
+class Writer(object):
+    def __init__(self, width, height, alpha=False):
+        """
+        Writes GIF images.
+
+        | **option** | **description**
+        | --- | ---
+        | width/height | the size of the image in pixels
+        | *alpha | whether the rows passed to write have a fourth alpha value per pixel, default is False. Pixels whose alpha is below 128 become transparent.
+        """
+        self.width = width
+        self.height = height
+        self.alpha = alpha
+
+    def write(self, outfile, rows):
+        """
+        Writes the image to a file object opened in binary mode, given
+        an iterable of rows of flat RGB or RGBA values.
+        """
+        planes = 4 if self.alpha else 3
+        #gather pixels and count colors
+        pixels = []
+        for row in rows:
+            if planes == 4:
+                pixels.extend([(r,g,b) if a >= 128 else None
+                               for r,g,b,a in zip(row[0::4],row[1::4],row[2::4],row[3::4])])
+            else:
+                pixels.extend(zip(row[0::3],row[1::3],row[2::3]))
+        if len(pixels) != self.width*self.height:
+            raise Error("expected %d pixels, got %d" % (self.width*self.height, len(pixels)))
+        histogram = {}
+        for color in pixels:
+            histogram[color] = histogram.get(color, 0) + 1
+        transparent = histogram.pop(None, None) is not None
+        #make palette, with the last slot kept for transparency
+        maxcolors = 255 if transparent else 256
+        palette,mapping = quantize(histogram, maxcolors)
+        if transparent:
+            transindex = len(palette)
+            mapping[None] = transindex
+            palette.append((0,0,0))
+        #palette sizes are powers of two, at least 2 entries
+        bits = 1
+        while (1 << bits) < len(palette):
+            bits += 1
+        palette.extend([(0,0,0)] * ((1 << bits) - len(palette)))
+        indices = array('B', [mapping[color] for color in pixels])
+        mincodesize = max(2, bits)
+        compressed = lzw_encode(indices, mincodesize).tostring()
+        #header and logical screen descriptor with a global color table
+        out = [b'GIF89a',
+               struct.pack('<HHBBB', self.width, self.height, 0x80 | 0x70 | (bits-1), 0, 0),
+               struct.pack('%dB' % (len(palette)*3), *[spec for color in palette for spec in color])]
+        if transparent:
+            #graphic control extension
+            out.append(struct.pack('<BBBBHBB', 0x21, 0xF9, 4, 1, 0, transindex, 0))
+        #image descriptor and data in sub-blocks of at most 255 bytes
+        out.append(struct.pack('<BHHHHB', 0x2C, 0, 0, self.width, self.height, 0))
+        out.append(struct.pack('B', mincodesize))
+        for start in range(0, len(compressed), 255):
+            block = compressed[start:start+255]
+            out.append(struct.pack('B', len(block)))
+            out.append(block)
+        out.append(b'\x00;')
+        outfile.write(b''.join(out))
+
+
+#READING
+
+class Reader(object):
+    def __init__(self, filename=None, file=None, bytes=None):
+        """
+        Reads GIF images, from either a filename, a file object opened
+        in binary mode, or a string of bytes.
+        """
+        if filename:
+            with open(filename, "rb") as fileobj:
+                self.data = fileobj.read()
+        elif file:
+            self.data = file.read()
+        elif bytes is not None:
+            self.data = bytes
+        else:
+            raise TypeError("expecting filename, file or bytes")
+
+    def read(self):
+        """
+        Decodes the first frame of the image. Returns (width, height,
+        rows, metadata), with rows as arrays of flat RGB values, or RGBA
+        values if the image has transparency. The metadata dictionary
+        tells the "size", whether it has "alpha", and the
+        "palette" of RGB tuples.
+        """
+        data = self.data
+        if data[:6] not in (b'GIF87a', b'GIF89a'):
+            raise Error("not a GIF file")
+        width,height,flags,bgindex,_ = struct.unpack('<HHBBB', data[6:13])
+        pos = 13
+        palette = None
+        if flags & 0x80:
+            palette,pos = self._colortable(pos, flags)
+        transindex = None
+        #find the first image, remembering its graphic control extension
+        while True:
+            blocktype = data[pos:pos+1]
+            pos += 1
+            if blocktype == b'!':
+                label = bytearray(data[pos:pos+1])[0]
+                pos += 1
+                if label == 0xF9 and bytearray(data[pos:pos+1])[0] >= 4:
+                    packed,_,index = struct.unpack('<BHB', data[pos+1:pos+5])
+                    if packed & 1:
+                        transindex = index
+                _,pos = self._subblocks(pos)
+            elif blocktype == b',':
+                break
+            else:
+                raise Error("no image found in GIF file")
+        left,top,framewidth,frameheight,frameflags = struct.unpack('<HHHHB', data[pos:pos+9])
+        pos += 9
+        if frameflags & 0x80:
+            palette,pos = self._colortable(pos, frameflags)
+        if palette is None:
+            raise Error("GIF file has no color table")
+        mincodesize = bytearray(data[pos:pos+1])[0]
+        compressed,pos = self._subblocks(pos+1)
+        indices = lzw_decode(compressed, mincodesize)
+        #pad short data with the first color
+        size = framewidth*frameheight
+        if len(indices) < size:
+            indices += b'\x00' * (size - len(indices))
+        #translate the indices to colors one row at a time
+        alpha = transindex is not None
+        planes = 4 if alpha else 3
+        lookup = [struct.pack('%dB' % planes, *(color + (255,))[:planes]) for color in palette]
+        lookup.extend([lookup[0]] * (256 - len(lookup)))
+        if alpha:
+            lookup[transindex] = b'\x00\x00\x00\x00'
+        framerows = [array('B', b''.join([lookup[i] for i in bytearray(indices[y*framewidth:(y+1)*framewidth])]))
+                     for y in range(frameheight)]
+        if frameflags & 0x40:
+            #undo interlacing
+            order = [y for start,step in _interlacepasses for y in range(start, frameheight, step)]
+            deinterlaced = [None]*frameheight
+            for row,y in zip(framerows, order):
+                deinterlaced[y] = row
+            framerows = deinterlaced
+        #place the frame on the logical screen
+        if (left,top,framewidth,frameheight) == (0,0,width,height):
+            rows = framerows
+        else:
+            if alpha:
+                background = array('B', [0,0,0,0]) * width
+            else:
+                background = array('B', lookup[bgindex]) * width
+            rows = [array('B', background) for _ in range(height)]
+            right = min(width, left+framewidth)
+            for y,framerow in zip(range(top, height), framerows):
+                if right > left:
+                    rows[y][left*planes:right*planes] = framerow[:(right-left)*planes]
+        meta = dict(size=(width,height), alpha=alpha, palette=palette)
+        return width, height, rows, meta
+
+    #INTERNAL USE ONLY
+    def _colortable(self, pos, flags):
+        count = 2 << (flags & 0x07)
+        values = struct.unpack('%dB' % (count*3), self.data[pos:pos+count*3])
+        table = [values[i:i+3] for i in range(0, count*3, 3)]
+        return table, pos+count*3
+
+    def _subblocks(self, pos):
+        data = self.data
+        blocks = []
+        while True:
+            length = bytearray(data[pos:pos+1])
+            if not length:
+                #truncated file
+                break
+            length = length[0]
+            pos += 1
+            if length == 0:
+                break
+            blocks.append(data[pos:pos+length])
+            pos += length
+        return b''.join(blocks), pos
+
@@ -0,0 +1,357 @@
+# Pydraw submodule
+# Benchmarks for the drawing primitives, transforms and codecs
+
+"""
+Times each drawing primitive, transform and the PNG codec across canvas
+sizes and geometry complexities, so that changes to PyDraw (or to Python)
+can be checked for speed regressions.
+
+Run from the command line with "python -m pydraw.bench", see the options
+of that command, or use the functions here:
+
+- run: times all the benchmarks and returns the results as a dictionary
+- save/load: writes and reads results as JSON files
+- compare: compares results to earlier stored baseline results
+
+The results dictionary looks like this, with times in seconds:
+
+    {"python": "2.7.18 ...",
+     "platform": "linux2",
+     "results": {"drawline/size=100/n=10": {"best": 0.0012, "mean": 0.0013, "runs": 3},
+                 ...}}
+"""
+
+import sys,os,time,math,json,random,tempfile,shutil,subprocess
+import pydraw
+
+
+_TEMPFOLDER = None #the folder for the files of the codec benchmarks, made and removed again by run
+
+
+#THE BENCHMARKS
+#each takes a canvas size and geometry complexity n, prepares everything
+#that should not be timed, and returns the function to time
+
+def _drawline(size, n):
+    img = pydraw.Image(size, size)
+    rand = random.Random(n)
+    lines = [[rand.uniform(0,size) for _ in xrange(4)] for _ in xrange(n)]
+    def bench():
+        for x1,y1,x2,y2 in lines:
+            img.drawline(x1, y1, x2, y2, fillcolor=(0,0,0), fillsize=1)
+    return bench
+
+def _drawline_roundcaps(size, n):
+    #thick road segments with round caps, all of the same width
+    img = pydraw.Image(size, size)
+    rand = random.Random(n)
+    lines = [[rand.uniform(0,size) for _ in xrange(4)] for _ in xrange(n)]
+    def bench():
+        for x1,y1,x2,y2 in lines:
+            img.drawline(x1, y1, x2, y2, fillcolor=(0,0,0), fillsize=6, capstyle="round")
+    return bench
+
+def _drawmultiline(joinstyle):
+    def setup(size, n):
+        img = pydraw.Image(size, size)
+        #zigzag across the canvas
+        coords = [(size*0.1 + size*0.8*index/float(n-1), size*(0.3 if index%2 else 0.7)) for index in xrange(n)]
+        def bench():
+            img.drawmultiline(coords, fillcolor=(0,0,0), fillsize=5, joinstyle=joinstyle)
+        return bench
+    return setup
+
+def _drawpolygon(size, n):
+    img = pydraw.Image(size, size)
+    mid = size/2.0
+    #star with a square hole in the middle
+    coords = []
+    for index in xrange(n):
+        angle = 2*math.pi*index/float(n)
+        radius = size*(0.45 if index%2 else 0.3)
+        coords.append((mid + radius*math.cos(angle), mid + radius*math.sin(angle)))
+    hole = [(mid-size*0.1,mid-size*0.1),(mid+size*0.1,mid-size*0.1),(mid+size*0.1,mid+size*0.1),(mid-size*0.1,mid+size*0.1)]
+    def bench():
+        img.drawpolygon(list(coords), holes=[list(hole)], fillcolor=(0,222,0), outlinecolor=(0,0,0), outlinewidth=1)
+    return bench
+
+def _drawpolygon_supersampled(factor):
+    def setup(size, n):
+        img = pydraw.Image(size, size, supersample=factor)
+        rand = random.Random(n)
+        coords = [(rand.uniform(0,size), rand.uniform(0,size)) for _ in xrange(n)]
+        def bench():
+            img.drawpolygon(list(coords), fillcolor=(0,222,0))
+        return bench
+    return setup
+
+def _drawcircle(size, n):
+    img = pydraw.Image(size, size)
+    rand = random.Random(n)
+    circles = [(rand.uniform(0,size), rand.uniform(0,size)) for _ in xrange(n)]
+    def bench():
+        for x,y in circles:
+            img.drawcircle(x, y, fillsize=size/10.0, fillcolor=(222,0,0), outlinecolor=(0,0,0))
+    return bench
+
+def _drawcircle_multiply(size, n):
+    #circles multiplied onto the image, as for hillshading
+    img = pydraw.Image(size, size)
+    rand = random.Random(n)
+    circles = [(rand.uniform(0,size), rand.uniform(0,size)) for _ in xrange(n)]
+    def bench():
+        for x,y in circles:
+            img.drawcircle(x, y, fillsize=size/10.0, fillcolor=(128,128,128), blendmode="multiply")
+    return bench
+
+def _drawcircle_linear(size, n):
+    #semitransparent circles blended in linear light
+    img = pydraw.Image(size, size, linearblend=True)
+    rand = random.Random(n)
+    circles = [(rand.uniform(0,size), rand.uniform(0,size)) for _ in xrange(n)]
+    def bench():
+        for x,y in circles:
+            img.drawcircle(x, y, fillsize=size/10.0, fillcolor=(222,0,0,128))
+    return bench
+
+def _subpixelpoints(size, n):
+    #a point cloud of semitransparent points at floating point positions
+    img = pydraw.Image(size, size)
+    rand = random.Random(n)
+    points = [(rand.uniform(0,size), rand.uniform(0,size)) for _ in xrange(n*100)]
+    def bench():
+        put = img._put
+        for x,y in points:
+            put(x, y, (222,0,0,128))
+    return bench
+
+def _drawbezier(size, n):
+    img = pydraw.Image(size, size)
+    points = [(size*0.1,size*0.9),(size*0.3,size*0.1),(size*0.7,size*0.1),(size*0.9,size*0.9)]
+    def bench():
+        img.drawbezier(points, fillcolor=(0,0,0), intervals=n*10)
+    return bench
+
+def _drawarc(size, n):
+    img = pydraw.Image(size, size)
+    rand = random.Random(n)
+    arcs = [(rand.uniform(0,size), rand.uniform(0,size), rand.randrange(0,360)) for _ in xrange(n)]
+    def bench():
+        for x,y,facing in arcs:
+            img.drawarc(x, y, radius=int(size/10), opening=90, facing=facing, fillcolor=(0,0,222))
+    return bench
+
+def _drawcircle_rgba(size, n):
+    #semitransparent circles blended onto a transparent canvas
+    img = pydraw.Image(size, size, mode="RGBA")
+    rand = random.Random(n)
+    circles = [(rand.uniform(0,size), rand.uniform(0,size)) for _ in xrange(n)]
+    def bench():
+        for x,y in circles:
+            img.drawcircle(x, y, fillsize=size/10.0, fillcolor=(222,0,0,128))
+    return bench
+
+def _floodfill_exact(size, n):
+    img = pydraw.Image(size, size, background=(255,255,255))
+    img.drawrectangle([2,2,size-3,size-3], fillcolor=None, outlinecolor=(0,0,0))
+    def bench():
+        img.floodfill(size//2, size//2, fillcolor=(0,0,222))
+    return bench
+
+def _floodfill_fuzzy(size, n):
+    #bright outline and fill, so both stop the fill
+    img = pydraw.Image(size, size, background=(100,100,100))
+    img.drawrectangle([2,2,size-3,size-3], fillcolor=None, outlinecolor=(255,255,255))
+    def bench():
+        img.floodfill(size//2, size//2, fillcolor=(200,200,200), fuzzythresh=0.5)
+    return bench
+
+def _tilt(size, n):
+    img = pydraw.Image(size, size)
+    oldplane = [(0,0),(size,0),(size,size),(0,size)]
+    newplane = [(size*0.1,0),(size*0.9,0),(size,size),(0,size)]
+    def bench():
+        img.tilt(oldplane, newplane)
+    return bench
+
+def _spheremapping(size, n):
+    img = pydraw.Image(size, size)
+    def bench():
+        img.spheremapping(sphereradius=size/2)
+    return bench
+
+def _pastedata(size, n):
+    img = pydraw.Image(size, size)
+    half = size//2
+    data = [[(index%256,0,0) for index in xrange(half)] for _ in xrange(half)]
+    def bench():
+        img.pastedata(size//4, size//4, data, transparency=0.5)
+    return bench
+
+def _paste_mosaic(size, n):
+    #opaque tiles pasted side by side into a composite
+    img = pydraw.Image(size, size)
+    tilesize = max(size//8, 1)
+    tile = pydraw.Image(tilesize, tilesize, background=(0,222,0))
+    def bench():
+        for y in xrange(0, size, tilesize):
+            for x in xrange(0, size, tilesize):
+                img.paste(tile, x, y)
+    return bench
+
+def _paste_blended(size, n):
+    img = pydraw.Image(size, size)
+    tile = pydraw.Image(size//2, size//2, mode="RGBA", background=(0,222,0,128))
+    def bench():
+        img.paste(tile, size//4, size//4, blendmode="multiply")
+    return bench
+
+def _layers_toggle(size, n):
+    #hiding and showing a layer that covers a tenth of the rows
+    layered = pydraw.LayeredImage(size, size)
+    layered.addlayer("base").drawrectangle([0,0,size-1,size-1], fillcolor=(0,222,0))
+    layered.addlayer("top").drawrectangle([0,0,size-1,size//10], fillcolor=(222,0,0))
+    layered.flatten()
+    def bench():
+        layered.setlayer("top", visible=False)
+        layered.flatten()
+        layered.setlayer("top", visible=True)
+        layered.flatten()
+    return bench
+
+def _pngsave(size, n):
+    img = pydraw.Image(size, size)
+    img.drawcircle(size/2, size/2, fillsize=size/3, fillcolor=(222,0,0))
+    path = os.path.join(_TEMPFOLDER, "bench.png")
+    def bench():
+        img.save(path)
+    return bench
+
+def _pngsave_rgba(size, n):
+    img = pydraw.Image(size, size, mode="RGBA")
+    img.drawcircle(size/2, size/2, fillsize=size/3, fillcolor=(222,0,0,128))
+    path = os.path.join(_TEMPFOLDER, "bench.png")
+    def bench():
+        img.save(path)
+    return bench
+
+def _pngload(size, n):
+    img = pydraw.Image(size, size)
+    img.drawcircle(size/2, size/2, fillsize=size/3, fillcolor=(222,0,0))
+    path = os.path.join(_TEMPFOLDER, "bench.png")
+    img.save(path)
+    def bench():
+        pydraw.Image(filepath=path)
+    return bench
+
+def _import(size, n):
+    #a fresh interpreter importing pydraw, as paid by each short-lived job
+    packagefolder = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    def bench():
+        subprocess.check_call([sys.executable, "-c", "import pydraw"], cwd=packagefolder)
+    return bench
+
+#name, setup function, and whether the canvas size and geometry complexity matter
+BENCHMARKS = [("import", _import, ""),
+              ("drawline", _drawline, "size+n"),
+              ("drawline_roundcaps", _drawline_roundcaps, "size+n"),
+              ("drawmultiline_miter", _drawmultiline("miter"), "size+n"),
+              ("drawmultiline_round", _drawmultiline("round"), "size+n"),
+              ("drawmultiline_bevel", _drawmultiline("bevel"), "size+n"),
+              ("drawpolygon_holes", _drawpolygon, "size+n"),
+              ("drawpolygon_supersample4", _drawpolygon_supersampled(4), "size+n"),
+              ("drawcircle", _drawcircle, "size+n"),
+              ("drawcircle_rgba", _drawcircle_rgba, "size+n"),
+              ("drawcircle_multiply", _drawcircle_multiply, "size+n"),
+              ("drawcircle_linear", _drawcircle_linear, "size+n"),
+              ("subpixelpoints", _subpixelpoints, "size+n"),
+              ("drawbezier", _drawbezier, "size+n"),
+              ("drawarc", _drawarc, "size+n"),
+              ("floodfill_exact", _floodfill_exact, "size"),
+              ("floodfill_fuzzy", _floodfill_fuzzy, "size"),
+              ("tilt", _tilt, "size"),
+              ("spheremapping", _spheremapping, "size"),
+              ("pastedata", _pastedata, "size"),
+              ("paste_mosaic", _paste_mosaic, "size"),
+              ("paste_blended", _paste_blended, "size"),
+              ("layers_toggle", _layers_toggle, "size"),
+              ("pngsave", _pngsave, "size"),
+              ("pngsave_rgba", _pngsave_rgba, "size"),
+              ("pngload", _pngload, "size")]
+
+
+#RUNNING AND COMPARING
+
+def run(sizes=(100,400), complexities=(10,100), repeat=3, names=None, report=None):
+    """
+    Times the benchmarks and returns the results dictionary.
+    Each benchmark is set up anew before every timed run, and the best and mean times are kept.
+
+    | **option** | **description**
+    | --- | ---
+    | *sizes | the widths/heights of the square canvases to draw on, in pixels
+    | *complexities | the numbers of shapes or vertices to draw, for the benchmarks where that matters
+    | *repeat | how many times to time each benchmark
+    | *names | only run the benchmarks whose name starts with one of these strings
+    | *report | a function to call with the name and result of each benchmark once it is done, eg to print progress
+
+    """
+    global _TEMPFOLDER
+    results = dict()
+    _TEMPFOLDER = tempfile.mkdtemp()
+    try:
+        for name,setup,dimensions in BENCHMARKS:
+            if names and not any(name.startswith(each) for each in names):
+                continue
+            for size in (sizes if "size" in dimensions else (None,)):
+                for n in (complexities if "n" in dimensions else (None,)):
+                    key = name
+                    if size is not None:
+                        key += "/size=%d" % size
+                    if n is not None:
+                        key += "/n=%d" % n
+                    times = []
+                    for _ in xrange(repeat):
+                        bench = setup(size, n)
+                        start = time.time()
+                        bench()
+                        times.append(time.time() - start)
+                    results[key] = dict(best=min(times), mean=sum(times)/len(times), runs=len(times))
+                    if report:
+                        report(key, results[key])
+    finally:
+        shutil.rmtree(_TEMPFOLDER, ignore_errors=True)
+        _TEMPFOLDER = None
+    return dict(python=sys.version, platform=sys.platform, results=results)
+
+def save(results, filepath):
+    """
+    Writes results to a JSON file.
+    """
+    with open(filepath, "w") as fileobj:
+        json.dump(results, fileobj, indent=1, sort_keys=True)
+
+def load(filepath):
+    """
+    Reads results from a JSON file.
+    """
+    with open(filepath) as fileobj:
+        return json.load(fileobj)
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Compares the best times of results to those of baseline results, for the
+    benchmarks that are in both. Returns a list of (key, baselinetime, newtime, ratio)
+    tuples for the benchmarks that got slower by more than the tolerance,
+    eg 0.1 for 10 percent, slowest first.
+    """
+    regressions = []
+    for key,result in results["results"].items():
+        old = baseline["results"].get(key)
+        if not old:
+            continue
+        ratio = result["best"] / max(old["best"], 1e-9)
+        if ratio > 1 + tolerance:
+            regressions.append((key, old["best"], result["best"], ratio))
+    regressions.sort(key=lambda regression: regression[3], reverse=True)
+    return regressions
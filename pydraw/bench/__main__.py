@@ -0,0 +1,33 @@
+# Pydraw submodule
+# Command line for the benchmarks, run with "python -m pydraw.bench"
+
+import sys,argparse
+from pydraw import bench
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the PyDraw drawing primitives, transforms and codecs.")
+    parser.add_argument("--out", help="JSON file to write the results to")
+    parser.add_argument("--baseline", help="JSON file with earlier results to compare to, exits with 1 if anything got slower")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="how much slower than the baseline is allowed, default 0.1 (10 percent)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100,400], help="canvas sizes in pixels")
+    parser.add_argument("--complexities", type=int, nargs="+", default=[10,100], help="numbers of shapes or vertices")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("names", nargs="*", help="only run benchmarks whose name starts with these")
+    args = parser.parse_args()
+
+    def report(key, result):
+        sys.stdout.write("%-40s %10.4f s\n" % (key, result["best"]))
+        sys.stdout.flush()
+    results = bench.run(sizes=args.sizes, complexities=args.complexities, repeat=args.repeat, names=args.names, report=report)
+    if args.out:
+        bench.save(results, args.out)
+    if args.baseline:
+        regressions = bench.compare(results, bench.load(args.baseline), tolerance=args.tolerance)
+        for key,old,new,ratio in regressions:
+            sys.stdout.write("SLOWER %-33s %10.4f s -> %.4f s (%.2fx)\n" % (key, old, new, ratio))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
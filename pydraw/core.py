@@ -1,20 +1,48 @@
 # Pydraw submodule
 # The main core for creating, loading, and drawing on images
 
-import sys,os,math,operator,itertools
+import sys,os,io,time,math,operator,itertools,array,struct,mmap,base64,hashlib,importlib,contextlib,errno,threading
 #import submodules
-import _fileformats
-from _fileformats import png,bmp
 import geomhelper
 from geomhelper import _Line, _Bezier, _Arc
 
 
+class _LazyModule(object):
+    """
+    Stands in for a module and only imports it the first time one of its
+    attributes is used, so that importing pydraw stays fast when eg the
+    file formats or Tkinter are never needed.
+    For internal use only.
+    """
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+    def _load(self):
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+        return self._module
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+_PACKAGE = __name__.rpartition(".")[0]
+_PACKAGE = _PACKAGE + "." if _PACKAGE else ""
+png = _LazyModule(_PACKAGE + "_fileformats.png")
+bmp = _LazyModule(_PACKAGE + "_fileformats.bmp")
+gif = _LazyModule(_PACKAGE + "_fileformats.gif")
+mt = _LazyModule(_PACKAGE + "advmatrix")
+multiprocessing = _LazyModule("multiprocessing")
+inspect = _LazyModule("inspect")
+tempfile = _LazyModule("tempfile")
+
+
 #PYTHON VERSION CHECKING
 PYTHON3 = int(sys.version[0]) == 3
 if PYTHON3:           
-    import tkinter as tk
+    tk = _LazyModule("tkinter")
 else:           
-    import Tkinter as tk
+    tk = _LazyModule("Tkinter")
 
 
 def xrange(start_or_stop, stop=None, step=1):
@@ -31,11 +59,31 @@ def xrange(start_or_stop, stop=None, step=1):
         cur += step
 
 
+#ASYNC SETTINGS
+ASYNC_EXECUTOR = None #the concurrent.futures executor for render_async and encode_async, None means the default one of the event loop
+ASYNC_MAXJOBS = 4 #how many of those jobs may run at once, the rest wait their turn
+ASYNC_MAXWAITING = 64 #how many jobs may wait their turn, more raise a RuntimeError
+ASYNC_MAXCHUNKS = 4 #how many encoded pieces may wait to be handed to onchunk before the encoding pauses
+
+#ALPHA TABLES
+_ALPHATABLES = None #the integer multiply and divide tables for RGBA images, made when first needed
+_CLAMP = [min(value, 255) for value in range(512)] #for sums of two color values that may round to above 255
+_GAMMATABLES = None #the sRGB to linear light and back tables for linear blending, made when first needed
+_SUBPIXELWEIGHTS = None #the integer weights for spreading points at floating point positions, made when first needed
+_LINETEMPLATES = dict() #the cap and join outlines made so far by line width and style, see _linetemplate
+
+
 #THE CLASSES
 
 class Image(object):
+    _stats = None #the statistics dictionary while collecting statistics, see startstats
+    _recording = False #whether shapes are being recorded for supersampling, see _blendlayer
+    mode = "RGB"
+    supersample = 1
+    linearblend = False
+
     #STARTING
-    def __init__(self,width=None,height=None,background=None,filepath=None,data=None,crs=None):
+    def __init__(self,width=None,height=None,background=None,filepath=None,data=None,crs=None,mode="RGB",supersample=1,linearblend=False):
         """
         The main image instance, which can load or create a new image.
         Also has various methods for drawing and transforming the image.
@@ -67,18 +115,87 @@ class Image(object):
         | **option** | **description**
         | --- | --- 
         | *crs | a coordinate system instance that defines the desired coordinate space of the image. 
+
+        By default the image is opaque. An image that can itself be transparent,
+        eg for overlays that are later placed on top of other images, is made by
+        setting the mode to "RGBA". Its pixels are then RGBA tuples with the color
+        values premultiplied by the alpha value, ie (r*a/255, g*a/255, b*a/255, a),
+        which makes blending fast and exact. Such an image is saved with its
+        transparency to PNG, GIF (only fully transparent or not), BMP and PAM files,
+        but not to PPM, and is viewed as if drawn on black.
+
+        | **option** | **description**
+        | --- | --- 
+        | *mode | "RGB" for an opaque image (default), or "RGBA" for an image with transparency. In RGBA mode the background defaults to fully transparent, and loaded images keep their transparency.
+
+        For smoother antialiasing than the default subpixel precision, each shape can
+        instead be drawn at several times the resolution and then scaled down by averaging
+        the colors, at the cost of speed. The setting can also be changed later through
+        the ".supersample" property.
+
+        | **option** | **description**
+        | --- | --- 
+        | *supersample | how many times the resolution to draw at in each direction, eg 4 for 4x4 samples per pixel. The default 1 turns supersampling off.
+
+        Colors are normally blended as their stored sRGB values, which makes antialiased
+        edges and thin lines look too dark. They can instead be blended as the light
+        intensities they stand for, with lookup tables to and from linear light.
+        This applies to all drawing, blend modes, pasting and supersampling, and
+        can also be changed later through the ".linearblend" property.
+
+        | **option** | **description**
+        | --- | --- 
+        | *linearblend | True to blend colors in linear light, default is False
+
+        The draw methods, paste and pastedata take a blendmode argument for how the new colors are
+        combined with the colors already on the image. The shape is first drawn on its own
+        transparent layer, which is then blended onto the image a whole row at a time.
+
+        | **blendmode** | **description**
+        | --- | --- 
+        | normal | the new colors are drawn on top, the default
+        | multiply | multiplies the colors, which always darkens, eg for hillshading
+        | screen | multiplies the inverted colors, which always lightens
+        | darken | keeps the darkest of the two colors, for each of red, green and blue
+        | lighten | keeps the lightest of the two colors, for each of red, green and blue
+        | destination-over | draws behind the existing colors, only visible where the image is transparent
+        | source-atop | draws only where the image already has color
+        | destination-out | erases the image where drawn
+        | xor | keeps the new and old colors only where the other is missing
+        | source-in | keeps the new colors only where the image already has color, and erases the rest of the image
+        | source-out | keeps the new colors only where the image is transparent, and erases the rest of the image
+        | destination-in | keeps the image only where drawn, and erases the rest, eg for masking
+        | destination-atop | keeps the image where drawn and the new colors where the image is transparent, and erases the rest
+        | copy | replaces the image with just the new colors
+        | clear | erases the whole image
+        
+        All but the first five need an RGBA image, and the last six apply to the whole image,
+        not just where the shape is drawn.
         
         """
         #initiate image
+        if mode not in ("RGB","RGBA"):
+            raise ValueError("mode must be RGB or RGBA, not %s" % mode)
+        self.mode = mode
+        self.supersample = supersample
+        self.linearblend = linearblend
         if filepath or data:
             self._loadimage(filepath, data)
         else:
             self.width = width
             self.height = height
             if not background:
-                background = (200,200,200)
+                background = (200,200,200) if mode == "RGB" else (0,0,0,0)
+            if mode == "RGBA":
+                background = _premultiply(background)
             horizline = [background for _ in xrange(width)]
             self.imagegrid = [list(horizline) for _ in xrange(height)]
+        if mode == "RGBA":
+            #blend with integer tables instead of the float math of the normal _put
+            self._put = self._putpremultiplied
+        #one flag per row for keeping track of changed rows, and a copy of them per consumer, see popdirtyrows
+        self._dirty = bytearray(self.height or 0)
+        self._dirtyviews = dict()
         #set coordinate system
         self.crs = crs
         if crs:
@@ -122,10 +239,12 @@ class Image(object):
                 return newpoint
             except ZeroDivisionError:
                 pass
-        newimg = Image().new(self.width,self.height)
+        newimg = Image(self.width,self.height,mode=self.mode)
         for y in xrange(len(self.imagegrid)):
             for x in xrange(len(self.imagegrid[0])):
                 color = self._get(x,y)
+                if self.mode == "RGBA":
+                    color = _unpremultiply(color)
                 newpos = pixel2sphere(x,y,z=0)
                 if newpos:
                     newx,newy,newz = newpos
@@ -161,7 +280,6 @@ class Image(object):
         for p1,p2 in zip(pa, pb):
             grid.append([p1[0], p1[1], 1, 0, 0, 0, -p2[0]*p1[0], -p2[0]*p1[1]])
             grid.append([0, 0, 0, p1[0], p1[1], 1, -p2[1]*p1[0], -p2[1]*p1[1]])
-        import pydraw.advmatrix as mt
         A = mt.Matrix(grid)
         B = mt.Vec([xory for xy in pb for xory in xy])
         AT = A.tr()
@@ -173,10 +291,12 @@ class Image(object):
         #then calculate new coords, thanks to http://math.stackexchange.com/questions/413860/is-perspective-transform-affine-if-it-is-why-its-impossible-to-perspective-a"
         k = 1
         a,b,c,d,e,f,g,h = transcoeff
-        outimg = Image().new(self.width,self.height)
+        outimg = Image(self.width,self.height,mode=self.mode)
         for y in xrange(len(self.imagegrid)):
             for x in xrange(len(self.imagegrid[0])):
                 color = self._get(x,y)
+                if self.mode == "RGBA":
+                    color = _unpremultiply(color)
                 newx = int(round((a*x+b*y+c)/float(g*x+h*y+k)))
                 newy = int(round((d*x+e*y+f)/float(g*x+h*y+k)))
                 try:
@@ -227,41 +347,9 @@ class Image(object):
         if x < 0 or y < 0:
             #out of bounds
             return
-        #if floating xy coords, make into semitransparent colors
+        #if floating xy coords, spread over the nearest pixels as semitransparent colors
         if isinstance(x, float) or isinstance(y, float):
-            #calc values
-            xint,yint = int(x), int(y)
-            xfloat,yfloat = x-xint, y-yint
-            if xfloat:
-                x1,x2 = xint,xint+1
-                x1transp,x2transp = 1-xfloat,xfloat
-            if yfloat:
-                y1,y2 = yint,yint+1
-                y1transp,y2transp = 1-yfloat,yfloat
-            #allow transp color
-            if len(color)==3:
-                r,g,b = color
-                color = (r,g,b,255)
-            #disperse pixels
-            if xfloat and yfloat:
-                newcolor = (color[0],color[1],color[2],color[3]*x1transp*y1transp)
-                self._put(x1,y1,newcolor)
-                newcolor = (color[0],color[1],color[2],color[3]*x1transp*y2transp)
-                self._put(x1,y2,newcolor)
-                newcolor = (color[0],color[1],color[2],color[3]*x2transp*y1transp)
-                self._put(x2,y1,newcolor)
-                newcolor = (color[0],color[1],color[2],color[3]*x2transp*y2transp)
-                self._put(x2,y2,newcolor)
-            elif xfloat:
-                newcolor = (color[0],color[1],color[2],color[3]*x1transp)
-                self._put(x1,yint,newcolor)
-                newcolor = (color[0],color[1],color[2],color[3]*x2transp)
-                self._put(x2,yint,newcolor)
-            elif yfloat:
-                newcolor = (color[0],color[1],color[2],color[3]*y1transp)
-                self._put(xint,y1,newcolor)
-                newcolor = (color[0],color[1],color[2],color[3]*y2transp)
-                self._put(xint,y2,newcolor)
+            self._putsubpixel(x, y, color)
             return
         #or plot normal whole pixels
         elif len(color)==3:
@@ -274,37 +362,234 @@ class Image(object):
                 p = self._get(int(x),int(y))
             except IndexError:
                 return #pixel outside img boundary
-            color = (int((p[0]*(1-t)) + color[0]*t), int((p[1]*(1-t)) + color[1]*t), int((p[2]*(1-t)) + color[2]*t))
+            if self.linearblend:
+                tolinear,fromlinear = _gammatables()
+                color = (fromlinear[int(tolinear[p[0]]*(1-t) + tolinear[int(color[0])]*t + 0.5)],
+                         fromlinear[int(tolinear[p[1]]*(1-t) + tolinear[int(color[1])]*t + 0.5)],
+                         fromlinear[int(tolinear[p[2]]*(1-t) + tolinear[int(color[2])]*t + 0.5)])
+            else:
+                color = (int((p[0]*(1-t)) + color[0]*t), int((p[1]*(1-t)) + color[1]*t), int((p[2]*(1-t)) + color[2]*t))
         #finally draw it
         try: self.imagegrid[y][x] = color
         except IndexError:
-            pass #pixel outside img boundary
+            return #pixel outside img boundary
+        self._dirty[y] = 1
 
-    def pastedata(self, x, y, data, anchor="nw", transparency=0):
+    def _putsubpixel(self, x,y,color):
         """
-        Pastes a list of lists of pixels onto the image at the specified position
-        Note: for now, data has to be 3(rgb) tuples, not 4(rgba)
-        and only nw anchor supported for now
+        Deposits a point at a floating point position, spread over the four pixels
+        it falls on by how much of it lands on each. The fractions are rounded to
+        sixteenths, so the four weights come from a precomputed integer table
+        and are blended with the integer alpha tables.
+        For internal use only.
+        """
+        qx,qy = int(x*16 + 0.5),int(y*16 + 0.5)
+        xint,yint = qx >> 4,qy >> 4
+        weights = _subpixelweights()[((qy & 15) << 4) | (qx & 15)]
+        r,g,b = int(color[0]),int(color[1]),int(color[2])
+        multiply = _alphatables()[0]
+        if len(color) == 4 and color[3] < 255:
+            scale = multiply[max(int(color[3] + 0.5), 0)]
+            weights = [scale[weight] for weight in weights]
+        rgba = self.mode == "RGBA"
+        width,height = self.width,self.height
+        for px,py,weight in ((xint,yint,weights[0]),(xint+1,yint,weights[1]),
+                             (xint,yint+1,weights[2]),(xint+1,yint+1,weights[3])):
+            if not weight or px >= width or py >= height:
+                continue
+            if self.linearblend:
+                #leave the gamma to the whole pixel blending
+                if rgba:
+                    self._putpremultiplied(px, py, (r,g,b,weight))
+                else:
+                    Image._put(self, px, py, (r,g,b,weight))
+                continue
+            source,keep = multiply[weight],multiply[255-weight]
+            row = self.imagegrid[py]
+            p = row[px]
+            if rgba:
+                row[px] = (source[r] + keep[p[0]], source[g] + keep[p[1]], source[b] + keep[p[2]], weight + keep[p[3]])
+            else:
+                row[px] = (source[r] + keep[p[0]], source[g] + keep[p[1]], source[b] + keep[p[2]])
+            self._dirty[py] = 1
+
+    def _putpremultiplied(self, x,y,color):
+        #the _put of RGBA images, which composites source-over with premultiplied integers
+        if x < 0 or y < 0:
+            #out of bounds
+            return
+        if isinstance(x, float) or isinstance(y, float):
+            #disperse the point as usual
+            return self._putsubpixel(x, y, color)
+        if len(color) == 3 or color[3] >= 255:
+            #solid color
+            color = (int(color[0]),int(color[1]),int(color[2]),255)
+        else:
+            a = int(color[3] + 0.5)
+            if a <= 0:
+                return
+            multiply = _alphatables()[0]
+            source,inverse = multiply[a],multiply[255-a]
+            try:
+                p = self.imagegrid[y][x]
+            except IndexError:
+                return #pixel outside img boundary
+            if self.linearblend and p[3]:
+                #weigh the straight linear colors by how much each adds to the new alpha
+                tolinear,fromlinear = _gammatables()
+                behind = _alphatables()[1][p[3]]
+                outa = a + inverse[p[3]]
+                wsource,wbehind = a/float(outa),inverse[p[3]]/float(outa)
+                result = multiply[outa]
+                color = (result[fromlinear[int(tolinear[int(color[0])]*wsource + tolinear[behind[p[0]]]*wbehind + 0.5)]],
+                         result[fromlinear[int(tolinear[int(color[1])]*wsource + tolinear[behind[p[1]]]*wbehind + 0.5)]],
+                         result[fromlinear[int(tolinear[int(color[2])]*wsource + tolinear[behind[p[2]]]*wbehind + 0.5)]],
+                         outa)
+            else:
+                color = (source[int(color[0])] + inverse[p[0]], source[int(color[1])] + inverse[p[1]],
+                         source[int(color[2])] + inverse[p[2]], a + inverse[p[3]])
+        try: self.imagegrid[y][x] = color
+        except IndexError:
+            return #pixel outside img boundary
+        self._dirty[y] = 1
+
+    def popdirtyrows(self, consumer=None):
+        """
+        Get the rows of the image that have been drawn on since the last call,
+        and mark them as unchanged again. Useful for updating only the changed
+        parts of a view or an output.
+        Each consumer of the changes gets all the changes since its own last call,
+        so that eg the Tkinter view (consumer "view") and a LayeredImage
+        (consumer "flatten") do not take the changes from each other.
+        The first call of a consumer gets the rows changed since any consumer
+        last asked, or since the image was made if none did, so a consumer
+        that starts asking late may miss earlier changes.
+
+        | **option** | **description**
+        | --- | --- 
+        | *consumer | any name for who is asking, default is None
+
+        Returns a list of (starty, stopy) tuples, one per band of changed rows,
+        with stopy being the row right after the band.
+        """
+        dirty = self._dirty
+        views = self._dirtyviews
+        if consumer not in views:
+            views[consumer] = bytearray(len(dirty))
+        #hand the rows changed since any consumer last asked to all of them
+        starty = dirty.find(b"\x01")
+        while starty != -1:
+            stopy = dirty.find(b"\x00", starty)
+            if stopy == -1:
+                stopy = len(dirty)
+            for view in views.values():
+                view[starty:stopy] = b"\x01" * (stopy - starty)
+            starty = dirty.find(b"\x01", stopy)
+        self._dirty = bytearray(len(dirty))
+        bands = []
+        view = views[consumer]
+        starty = view.find(b"\x01")
+        while starty != -1:
+            stopy = view.find(b"\x00", starty)
+            if stopy == -1:
+                stopy = len(view)
+            bands.append((starty, stopy))
+            starty = view.find(b"\x01", stopy)
+        views[consumer] = bytearray(len(view))
+        return bands
+
+    def paste(self, image, x=0, y=0, anchor="nw", opacity=1.0, mask=None, blendmode="normal"):
+        """
+        Pastes another image onto the image at the specified position.
+        The part that falls outside the image is cut off. Opaque images are
+        copied a whole row at a time, otherwise each row is blended at once.
+
+        | **option** | **description**
+        | --- | --- 
+        | image | the image instance to paste, RGB or RGBA
+        | x/y | where to put the anchor point of the pasted image, in coordinates if the image has a coordinate system
+        | *anchor | which point of the pasted image to put at x/y, "nw" (default), "n", "ne", "w", "center", "e", "sw", "s" or "se"
+        | *opacity | how opaque the pasted image is, from 0.0 (invisible) to 1.0 (default)
+        | *mask | a list of lists of opacity values from 0 to 255, one for each pixel of the pasted image, eg to only paste parts of it
+        | *blendmode | how the pasted colors are combined with those already on the image, see the Image class
+        
         """
         if self.coordmode:
             x,y = self.crs.point2pixel(x,y)
-        dataheight = len(data)
-        datawidth = len(data[0])
-        alpha = 255*transparency
-        if "n" in anchor:
-            if "w" in anchor:
-                datay = 0
-                for puty in xrange(y,y+dataheight):
-                    datax = 0
-                    for putx in xrange(x,x+datawidth):
-                        dpixel = data[datax][datay]
-                        r,g,b = dpixel
-                        dpixel = (r,g,b,alpha)
-                        self._put(putx,puty,dpixel)
-                        datax += 1
-                    datay += 1
+        kernel,unbounded = _blendkernel(blendmode, self.mode, self.linearblend)
+        #place the anchor point
+        x,y = int(round(x)),int(round(y))
+        if anchor == "center":
+            anchor = ""
+        if "w" in anchor: left = x
+        elif "e" in anchor: left = x - image.width
+        else: left = x - image.width//2
+        if "n" in anchor: top = y
+        elif "s" in anchor: top = y - image.height
+        else: top = y - image.height//2
+        #clip once
+        x1,y1 = max(left,0),max(top,0)
+        x2,y2 = min(left+image.width,self.width),min(top+image.height,self.height)
+        if x1 >= x2 or y1 >= y2:
+            if not unbounded:
+                return
+            y1 = y2 = 0
+        alpha = max(min(int(round(255*opacity)),255),0)
+        multiply = _alphatables()[0]
+        scale = multiply[alpha]
+        def sourcerow(sy):
+            #the premultiplied pixels of one pasted row within the clip
+            row = image.imagegrid[sy][x1-left:x2-left]
+            if mask is not None:
+                alphas = [scale[value] for value in mask[sy][x1-left:x2-left]]
+                if image.mode == "RGBA":
+                    return [(m[c[0]],m[c[1]],m[c[2]],m[c[3]]) for c,m in itertools.izip(row, (multiply[a] for a in alphas))]
+                return [(multiply[a][c[0]],multiply[a][c[1]],multiply[a][c[2]],a) for c,a in itertools.izip(row, alphas)]
+            if image.mode == "RGBA":
+                if alpha == 255:
+                    return row
+                return [(scale[c[0]],scale[c[1]],scale[c[2]],scale[c[3]]) for c in row]
+            return [(scale[c[0]],scale[c[1]],scale[c[2]],alpha) for c in row]
+        if unbounded:
+            #rows outside the pasted image change too
+            blank = [(0,0,0,0)] * self.width
+            for ty in xrange(self.height):
+                row = self.imagegrid[ty]
+                layer = blank[:x1] + sourcerow(ty-top) + blank[x2:] if y1 <= ty < y2 else blank
+                row[:] = kernel(row, layer)
+            y1,y2 = 0,self.height
+        elif blendmode == "normal" and alpha == 255 and mask is None and image.mode == "RGB":
+            #opaque, so just copy
+            for ty in xrange(y1, y2):
+                row = image.imagegrid[ty-top][x1-left:x2-left]
+                if self.mode == "RGBA":
+                    row = [(c[0],c[1],c[2],255) for c in row]
+                self.imagegrid[ty][x1:x2] = row
+        else:
+            for ty in xrange(y1, y2):
+                row = self.imagegrid[ty]
+                row[x1:x2] = kernel(row[x1:x2], sourcerow(ty-top))
+        self._dirty[y1:y2] = b"\x01" * (y2 - y1)
+        if self._stats is not None:
+            self._stats["spans"] += y2 - y1
+
+    def pastedata(self, x, y, data, anchor="nw", transparency=0, blendmode="normal"):
+        """
+        Pastes a list of lists of pixels onto the image at the specified position.
+
+        | **option** | **description**
+        | --- | --- 
+        | x/y | where to put the anchor point of the pixels, see paste
+        | data | a list of rows, each a list of RGB or RGBA color tuples
+        | *anchor | which point of the pixels to put at x/y, see paste
+        | *transparency | how transparent the pixels are, from 0.0 (default) to 1.0 (invisible)
+        | *blendmode | how the pixels are combined with those already on the image, see the Image class
+        
+        """
+        mode = "RGBA" if len(data[0][0]) == 4 else "RGB"
+        self.paste(Image(data=data, mode=mode), x, y, anchor=anchor, opacity=1-transparency, blendmode=blendmode)
             
-    def drawline(self, x1, y1, x2, y2, fillcolor=(0,0,0), outlinecolor=None, fillsize=1, outlinewidth=1, capstyle="butt"): #, bendfactor=None, bendside=None, bendanchor=None):
+    def drawline(self, x1, y1, x2, y2, fillcolor=(0,0,0), outlinecolor=None, fillsize=1, outlinewidth=1, capstyle="butt", blendmode="normal"): #, bendfactor=None, bendside=None, bendanchor=None):
         """
         Draws a single line.
 
@@ -315,6 +600,7 @@ class Image(object):
         | *outlinecolor | RGB color tuple to fill the outline of the line with, default is no outline
         | *fillsize | the thickness of the main line, as pixel integers
         | *outlinewidth | the width of the outlines, as pixel integers
+        | *blendmode | how the colors are combined with those already on the image, default is "normal". See the Image class for the other blend modes.
         
         """
 ##        maybe add these options in future
@@ -323,7 +609,8 @@ class Image(object):
 ##        - bendanchor is the float ratio to offset the bend from its default anchor point at the center of the line.
         if self.coordmode:
             (x1,y1),(x2,y2) = self.crs.coords2pixels([(x1,y1),(x2,y2)])
-        self._drawline(x1,y1,x2,y2,fillcolor=fillcolor,outlinecolor=outlinecolor,fillsize=fillsize,outlinewidth=outlinewidth,capstyle=capstyle)
+        with self._blendlayer(blendmode):
+            self._drawline(x1,y1,x2,y2,fillcolor=fillcolor,outlinecolor=outlinecolor,fillsize=fillsize,outlinewidth=outlinewidth,capstyle=capstyle)
 
     def _drawline(self, x1, y1, x2, y2, fillcolor=(0,0,0), outlinecolor=None, fillsize=1, outlinewidth=1, capstyle="butt"): #, bendfactor=None, bendside=None, bendanchor=None):
         #decide to draw single or thick line with outline
@@ -332,78 +619,20 @@ class Image(object):
             self._drawsimpleline(x1, y1, x2, y2, col=fillcolor, thick=fillsize)
         else:
             if outlinecolor or fillcolor:
-                linepolygon = []
-                #get orig params
-                buff = fillsize/2.0
-                xchange = x2-x1
-                ychange = y2-y1
-                try:
-                    origslope = ychange/float(xchange)
-                except ZeroDivisionError:
-                    origslope = ychange
-                angl = math.degrees(math.atan(origslope))
-                perpangl_rad = math.radians(angl-90) #perpendicular angle in radians
-                xbuff = buff * math.cos(perpangl_rad)
-                ybuff = buff * math.sin(perpangl_rad)
-                #leftline
-                leftx1,leftx2 = (x1-xbuff,x2-xbuff)
-                lefty1,lefty2 = (y1-ybuff,y2-ybuff)
-                leftlinecoords = (leftx1,lefty1,leftx2,lefty2)
-                #rightline
-                rightx1,rightx2 = (x1+xbuff,x2+xbuff)
-                righty1,righty2 = (y1+ybuff,y2+ybuff)
-                rightlinecoords = (rightx2,righty2,rightx1,righty1)
-                #finally draw the thick line as a polygon
-                if capstyle == "butt":
-                    linepolygon.extend(leftlinecoords)
-                    linepolygon.extend(rightlinecoords)
-                    def groupby2(iterable):
-                        args = [iter(iterable)] * 2
-                        return itertools.izip(*args)
-                    linepolygon = list(groupby2(linepolygon))
-                    self._drawpolygon(linepolygon, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth)
-                elif capstyle == "round":
-                    #left side
-                    linepolygon.extend(leftlinecoords)
-                    #right round tip
-                    ytipbuff = buff*2 * math.sin(math.radians(angl))
-                    xtipbuff = buff*2 * math.cos(math.radians(angl))
-                    xtipright = x2+xtipbuff
-                    ytipright = y2+ytipbuff
-                    roundcurve = _Bezier([leftlinecoords[-2:],(xtipright,ytipright),rightlinecoords[:2]], intervals=buff)
-                    def flatten(iterable):
-                        return itertools.chain.from_iterable(iterable)
-                    linepolygon.extend(list(flatten(roundcurve.coords)))
-                    #right side
-                    linepolygon.extend(rightlinecoords)
-                    #left round tip
-                    xtipleft = x1-xtipbuff
-                    ytipleft = y1-ytipbuff
-                    roundcurve = _Bezier([rightlinecoords[-2:],(xtipleft,ytipleft),leftlinecoords[:2]], intervals=buff)
-                    def flatten(iterable):
-                        return itertools.chain.from_iterable(iterable)
-                    linepolygon.extend(list(flatten(roundcurve.coords)))
-                    #draw as polygon
-                    def groupby2(iterable):
-                        args = [iter(iterable)] * 2
-                        return itertools.izip(*args)
-                    linepolygon = list(groupby2(linepolygon))
-                    self._drawpolygon(linepolygon, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth)
-                elif capstyle == "projecting":
-                    #left side
-                    ytipbuff = buff * math.sin(math.radians(angl))
-                    xtipbuff = buff * math.cos(math.radians(angl))
-                    linepolygon.extend([leftx2+xtipbuff, lefty2+ytipbuff, leftx1+xtipbuff, lefty1+ytipbuff])
-                    #right side
-                    linepolygon.extend([rightx1+xtipbuff, righty1+ytipbuff, rightx2+xtipbuff, righty2+ytipbuff])
-                    #draw as polygon
-                    def groupby2(iterable):
-                        args = [iter(iterable)] * 2
-                        return itertools.izip(*args)
-                    linepolygon = list(groupby2(linepolygon))
-                    self._drawpolygon(linepolygon, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth)
+                #the direction of the line, and the other way for the start cap
+                length = math.hypot(x2-x1, y2-y1)
+                if length:
+                    xdir,ydir = (x2-x1)/length,(y2-y1)/length
+                else:
+                    xdir,ydir = 1.0,0.0
+                #the cap template goes around the end from one side of the line to the other,
+                #so the end cap and the turned start cap together outline the whole line
+                template = _linetemplate(fillsize, capstyle)
+                linepolygon = [(x2 + along*xdir - across*ydir, y2 + along*ydir + across*xdir) for along,across in template]
+                linepolygon.extend((x1 - along*xdir + across*ydir, y1 - along*ydir - across*xdir) for along,across in template)
+                self._drawpolygon(linepolygon, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth)
 
-    def drawmultiline(self, coords, fillcolor=(0,0,0), outlinecolor=None, fillsize=1, outlinewidth=1, joinstyle="miter"): #, bendfactor=None, bendside=None, bendanchor=None):
+    def drawmultiline(self, coords, fillcolor=(0,0,0), outlinecolor=None, fillsize=1, outlinewidth=1, joinstyle="miter", blendmode="normal"): #, bendfactor=None, bendside=None, bendanchor=None):
         """
         Draws multiple lines between a list of coordinates, useful for making them connect together.
         
@@ -414,7 +643,8 @@ class Image(object):
         """
         if self.coordmode:
             coords = self.crs.coords2pixels(coords)
-        self._drawmultiline(coords,fillcolor=fillcolor,outlinecolor=outlinecolor,fillsize=fillsize,outlinewidth=outlinewidth,joinstyle=joinstyle)
+        with self._blendlayer(blendmode):
+            self._drawmultiline(coords,fillcolor=fillcolor,outlinecolor=outlinecolor,fillsize=fillsize,outlinewidth=outlinewidth,joinstyle=joinstyle)
 
     def _drawmultiline(self, coords, fillcolor=(0,0,0), outlinecolor=None, fillsize=1, outlinewidth=1, joinstyle="miter"): #, bendfactor=None, bendside=None, bendanchor=None):
         if fillsize <= 1:
@@ -494,8 +724,15 @@ class Image(object):
                     ##leftcurve = _Arc(midx,midy,radius=buffersize,startangle=leftangl,endangle=rightangl)
                     ##rightcurve = _Arc(midx-buffersize,midy-buffersize,radius=buffersize,startangle=leftangl,endangle=rightangl) #[(midx,midy)] #how do inner arc?
 
-                    leftcurve = _Bezier([line1_left.tolist()[1],midleft,line2_left.tolist()[0]], intervals=20).coords
-                    rightcurve = _Bezier([line1_right.tolist()[1],midright,line2_right.tolist()[0]], intervals=20).coords
+                    #the outer side goes around the mid point along the join template, the inner side meets at a point
+                    leftend,leftstart = line1_left.tolist()[1],line2_left.tolist()[0]
+                    if (leftend[0]-x2)*(x3-x2) + (leftend[1]-y2)*(y3-y2) < 0:
+                        leftcurve = [leftend] + _roundjoin(fillsize, x2, y2, leftend, leftstart) + [leftstart]
+                        rightcurve = [midright]
+                    else:
+                        rightend,rightstart = line1_right.tolist()[1],line2_right.tolist()[0]
+                        leftcurve = [midleft]
+                        rightcurve = [rightend] + _roundjoin(fillsize, x2, y2, rightend, rightstart) + [rightstart]
                     #add coords
                     linepolygon = []
                     linepolygon.append(linepolygon_left[-1])
@@ -503,8 +740,8 @@ class Image(object):
                     linepolygon.extend(list(reversed(rightcurve)))
                     linepolygon.append(linepolygon_right[-1])
                     self._drawpolygon(linepolygon, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth)
-                    linepolygon_left.extend(leftcurve)
-                    linepolygon_right.extend(rightcurve)
+                    linepolygon_left.append(leftcurve[-1])
+                    linepolygon_right.append(rightcurve[-1])
             elif joinstyle == "bevel":
                 #flattened
                 pass
@@ -606,7 +843,7 @@ class Image(object):
             plot(x, ybase+1, ydeci, col, steep)
             intery += gradient
 
-    def drawbezier(self, xypoints, fillcolor=(0,0,0), outlinecolor=None, fillsize=1, intervals=100):
+    def drawbezier(self, xypoints, fillcolor=(0,0,0), outlinecolor=None, fillsize=1, intervals=100, blendmode="normal"):
         """
         Draws a bezier curve given a list of coordinate control point pairs.
         Mostly taken directly from a stackoverflow post...
@@ -620,27 +857,29 @@ class Image(object):
         """
         if self.coordmode:
             xypoints = self.crs.coords2pixels(xypoints)
-        self._drawbezier(xypoints,fillcolor=fillcolor,outlinecolor=outlinecolor,fillsize=fillsize,intervals=intervals)
+        with self._blendlayer(blendmode):
+            self._drawbezier(xypoints,fillcolor=fillcolor,outlinecolor=outlinecolor,fillsize=fillsize,intervals=intervals)
 
     def _drawbezier(self, xypoints, fillcolor=(0,0,0), outlinecolor=None, fillsize=1, intervals=100):
-        curve = _Bezier(xypoints, intervals)
-        self._drawmultiline(curve.coords, fillcolor=fillcolor, outlinecolor=outlinecolor, fillsize=fillsize)
+        curve = self._beziercoords(xypoints, intervals)
+        self._drawmultiline(curve, fillcolor=fillcolor, outlinecolor=outlinecolor, fillsize=fillsize)
 
-    def drawarc(self, x, y, radius, opening=None, facing=None, startangle=None, endangle=None, fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1):
+    def drawarc(self, x, y, radius, opening=None, facing=None, startangle=None, endangle=None, fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1, blendmode="normal"):
         """
         Experimental, but seems to work correctly
         Optional to use opening and facings args, or start and end angle args
         """
         if self.coordmode:
             x,y = self.crs.point2pixel(x,y)
-        self._drawarc(x,y,radius,opening,facing,startangle,endangle,fillcolor=fillcolor,outlinecolor=outlinecolor,outlinewidth=outlinewidth)
+        with self._blendlayer(blendmode):
+            self._drawarc(x,y,radius,opening,facing,startangle,endangle,fillcolor=fillcolor,outlinecolor=outlinecolor,outlinewidth=outlinewidth)
         
     def _drawarc(self, x, y, radius, opening=None, facing=None, startangle=None, endangle=None, fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1):        
         arcpolygon = [(x,y)]
         arcpolygon.extend(_Arc(x, y, radius, opening=opening, facing=facing, startangle=startangle, endangle=endangle))
         self._drawpolygon(arcpolygon, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth)
 
-    def drawcircle(self, x, y, fillsize, fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1): #, flatten=None, flatangle=None):
+    def drawcircle(self, x, y, fillsize, fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1, blendmode="normal"): #, flatten=None, flatangle=None):
         """
         Draws a circle at specified centerpoint.
         
@@ -656,7 +895,8 @@ class Image(object):
         #flatangle=...
         if self.coordmode:
             x,y = self.crs.point2pixel(x,y)
-        self._drawcircle(x,y,fillsize, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth)
+        with self._blendlayer(blendmode):
+            self._drawcircle(x,y,fillsize, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth)
 
     def _drawcircle(self, x, y, fillsize, fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1): #, flatten=None, flatangle=None):
         #alternative circle algorithms
@@ -678,30 +918,32 @@ class Image(object):
             cornerpoints = relcontrolpoints[oldindex-1:oldindex+3]
             cornerpoints = [(x+relx,y+rely) for relx,rely in cornerpoints]
             #self._drawbezier(cornerpoints, fillsize=outlinewidth, fillcolor=outlinecolor, outlinecolor=None, intervals=int(fillsize*20))
-            circlepolygon.extend(_Bezier(cornerpoints, intervals=int(fillsize*3)).coords)
+            circlepolygon.extend(self._beziercoords(cornerpoints, intervals=int(fillsize*3)))
             oldindex += 3
         #then draw and fill as polygon
         self._drawpolygon(circlepolygon, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth)
 
-    def drawsquare(self, x,y,fillsize, fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1, outlinejoinstyle=None):
+    def drawsquare(self, x,y,fillsize, fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1, outlinejoinstyle=None, blendmode="normal"):
         if self.coordmode:
             x,y = self.crs.point2pixel(x,y)
-        self._drawsquare(x,y,fillsize, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth, outlinejoinstyle=outlinejoinstyle)
+        with self._blendlayer(blendmode):
+            self._drawsquare(x,y,fillsize, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth, outlinejoinstyle=outlinejoinstyle)
 
     def _drawsquare(self, x,y,fillsize, fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1, outlinejoinstyle=None):
         halfsize = fillsize/2.0
         rectanglecoords = [(x-halfsize,y-halfsize),(x+halfsize,y-halfsize),(x+halfsize,y+halfsize),(x-halfsize,y+halfsize),(x-halfsize,y-halfsize)]
         self._drawpolygon(coords=rectanglecoords, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth, outlinejoinstyle=outlinejoinstyle)
   
-    def drawpolygon(self, coords, holes=[], fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1, outlinejoinstyle="miter"):
+    def drawpolygon(self, coords, holes=[], fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1, outlinejoinstyle="miter", fillrule="evenodd", blendmode="normal"):
         """
         Draws a polygon based on input coordinates.
-        Note: as with other primitives, fillcolor does not work properly.
+        The fill is antialiased by the exact area of each pixel that the polygon covers.
         
         | **option** | **description**
         | --- | --- 
         | coords | list of coordinate point pairs that make up the polygon. Automatically detects whether to enclose the polygon.
         | *holes | optional list of one or more polygons that represent holes in the polygon, each hole being a list of coordinate point pairs. Hole polygon coordinates are automatically closed if they aren't already. 
+        | *fillrule | which parts of a self-intersecting polygon are inside, "evenodd" (default) for those enclosed an odd number of times, or "nonzero" for all enclosed parts. Holes are always left empty.
         | **other | also accepts various color and size arguments, see the docstring for drawline.
         
         """
@@ -709,9 +951,13 @@ class Image(object):
             coords = self.crs.coords2pixels(coords)
             if holes:
                 holes = [self.crs.coords2pixels(hole) for hole in holes]
-        self._drawpolygon(coords,holes=holes,fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth, outlinejoinstyle=outlinejoinstyle)
+        with self._blendlayer(blendmode):
+            self._drawpolygon(coords,holes=holes,fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth, outlinejoinstyle=outlinejoinstyle, fillrule=fillrule)
 
-    def _drawpolygon(self, coords, holes=[], fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1, outlinejoinstyle="miter"):
+    def _drawpolygon(self, coords, holes=[], fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1, outlinejoinstyle="miter", fillrule="evenodd"):
+        if self._stats is not None:
+            self._stats["polygons"] += 1
+            self._stats["edges"] += len(coords) + sum(len(hole) for hole in holes)
         #maybe autocomplete polygon and holes
         if coords[-1] != coords[0]:
             coords = list(coords)
@@ -722,70 +968,7 @@ class Image(object):
                 hole.append(hole[0])
         #first fill insides of polygon
         if fillcolor:
-            def pairwise(iterable):
-                a,b = itertools.tee(iterable)
-                next(b, None)
-                return itertools.izip(a,b)
-            def flatten(iterable):
-                return itertools.chain.from_iterable(iterable)
-            def groupby2(iterable):
-                args = [iter(iterable)] * 2
-                return itertools.izip(*args)
-            #main
-            def coordsandholes():
-                #generator for exterior coords and holes
-                for edge in pairwise(coords):
-                    yield edge
-                if holes:
-                    for hole in holes:
-                        for edge in pairwise(hole):
-                            yield edge
-            ysortededges = [ list(flatten(sorted(eachedge, key=operator.itemgetter(1)))) for eachedge in coordsandholes() ]
-            ysortededges = list(sorted(ysortededges, key=operator.itemgetter(1)))
-            edgeindex = 0
-            curedge = ysortededges[edgeindex]
-            checkedges = []
-            #get bbox
-            xs, ys = zip(*coords)
-            bbox = [min(xs), min(ys), max(xs), max(ys)]
-            #begin
-            xmin,ymin,xmax,ymax = bbox
-            ymin,ymax = map(int, map(round, (ymin,ymax)))
-            for y in xrange(ymin,ymax+1):
-                fillxs = []
-                fillxs_half = []
-                #collect relevant edges
-                "first from previous old ones"
-                tempcollect = [tempedge for tempedge in checkedges if tempedge[3] > y]
-                "then from new ones"
-                while curedge[1] <= y and edgeindex < len(ysortededges):
-                    tempcollect.append(curedge)
-                    edgeindex += 1
-                    try:
-                        curedge = ysortededges[edgeindex]
-                    except IndexError:
-                        break   #just to make higher
-                if tempcollect:
-                    checkedges = tempcollect
-                #find intersect
-                scanline = _Line(xmin,y,xmax,y)
-                for edge in checkedges:
-                    edge = _Line(*edge)
-                    intersection = scanline.intersect(edge)
-                    if intersection:
-                        ix,iy = intersection
-                        fillxs.append(ix)
-                #scan line and fill
-                fillxs = sorted(fillxs)
-                if fillxs:
-                    for fillmin,fillmax in groupby2(fillxs):
-                        fillmin,fillmax = map(int,map(round,(fillmin,fillmax)))
-                        for x in xrange(fillmin,fillmax+1):
-                            self._put(x,y,fillcolor)
-            #cheating to draw antialiased edges as lines
-            self._drawmultiline(coords, fillcolor=fillcolor, outlinecolor=None, fillsize=1)
-            for hole in holes:
-                self._drawmultiline(hole, fillcolor=fillcolor, outlinecolor=None, fillsize=1)
+            self._fillpolygon([coords] + list(holes), fillcolor, fillrule)
         #then draw outline
         if outlinecolor:
             coords.append(coords[1])
@@ -794,12 +977,13 @@ class Image(object):
                 hole.append(hole[1])
                 self._drawmultiline(hole, fillcolor=outlinecolor, fillsize=outlinewidth, outlinecolor=None, joinstyle=outlinejoinstyle)
 
-    def drawrectangle(self, bbox, fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1, outlinejoinstyle=None):
+    def drawrectangle(self, bbox, fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1, outlinejoinstyle=None, blendmode="normal"):
         if self.coordmode:
             x1,y1,x2,y2 = bbox
             (x1,y1),(x2,y2) = self.crs.coords2pixels([(x1,y1),(x2,y2)])
             bbox = [x1,y1,x2,y2]
-        self._drawrectangle(bbox, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth, outlinejoinstyle=outlinejoinstyle)
+        with self._blendlayer(blendmode):
+            self._drawrectangle(bbox, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth, outlinejoinstyle=outlinejoinstyle)
     def _drawrectangle(self, bbox, fillcolor=(0,0,0), outlinecolor=None, outlinewidth=1, outlinejoinstyle=None):
         x1,y1,x2,y2 = bbox
         rectanglecoords = [(x1,y1),(x1,y2),(x2,y2),(x2,y1),(x1,y1)]
@@ -861,49 +1045,111 @@ class Image(object):
                     self._drawline(ypos,bottomy,xpos+tickindent+1,bottomy,fillcolor=(0,0,0),fillsize=tickthick)
                     ypos += self.yheight
 
-    def drawgeojson(self, geojobj, fillcolor=(0,0,0), outlinecolor=None, fillsize=1, outlinewidth=1, joinstyle="miter", outlinejoinstyle="miter", capstyle="butt"): #, bendfactor=None, bendside=None, bendanchor=None):
-        """
-        Takes any object that has the __geo_interface__ attribute
-        """
-        geojson = geojobj.__geo_interface__
-        geotype = geojson["type"]
-        coords = geojson["coordinates"]
-        if geotype == "Point":
-            if self.coordmode:
-                coords = self.crs.point2pixel(*coords)
-            self._drawcircle(*coords, fillsize=fillsize, outlinecolor=outlinecolor, fillcolor=fillcolor, outlinewidth=outlinewidth)
-        elif geotype == "MultiPoint":
-            if self.coordmode:
-                coords = self.crs.coords2pixels(coords)
-            for point in coords:
-                self._drawcircle(*point, fillsize=fillsize, outlinecolor=outlinecolor, fillcolor=fillcolor, outlinewidth=outlinewidth)
-        elif geotype == "LineString":
-            if self.coordmode:
-                coords = self.crs.coords2pixels(coords)
-            self._drawmultiline(coords, fillcolor=fillcolor, outlinecolor=outlinecolor, fillsize=fillsize, outlinewidth=outlinewidth, joinstyle=joinstyle)
-        elif geotype == "MultiLineString":
-            if self.coordmode:
-                coords = (self.crs.coords2pixels(eachmulti) for eachmulti in coords)
-            for eachmulti in coords:
-                self._drawmultiline(eachmulti, fillcolor=fillcolor, outlinecolor=outlinecolor, fillsize=fillsize, outlinewidth=outlinewidth, joinstyle=joinstyle)
-        elif geotype == "Polygon":
-            if self.coordmode:
-                coords = [self.crs.coords2pixels(polyorhole) for polyorhole in coords]
-            exterior = coords[0]
-            interiors = []
-            if len(coords) > 1:
-                interiors.extend(coords[1:])
-            self._drawpolygon(exterior, holes=interiors, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth, outlinejoinstyle=outlinejoinstyle)
-        elif geotype == "MultiPolygon":
-            if self.coordmode:
-                coords = ([self.crs.coords2pixels(polyorhole) for polyorhole in eachmulti] for eachmulti in coords)
-            for eachmulti in coords:
-                exterior = eachmulti[0]
+    def drawgeojson(self, geojobj, fillcolor=(0,0,0), outlinecolor=None, fillsize=1, outlinewidth=1, joinstyle="miter", outlinejoinstyle="miter", capstyle="butt", blendmode="normal"): #, bendfactor=None, bendside=None, bendanchor=None):
+        """
+        Takes any object that has the __geo_interface__ attribute.
+        Also accepts the color, size, style and blendmode arguments of the other draw methods.
+        All parts of multipart geometries are blended onto the image together.
+        """
+        with self._blendlayer(blendmode):
+            geojson = geojobj.__geo_interface__
+            geotype = geojson["type"]
+            coords = geojson["coordinates"]
+            if geotype == "Point":
+                if self.coordmode:
+                    coords = self.crs.point2pixel(*coords)
+                self._drawcircle(*coords, fillsize=fillsize, outlinecolor=outlinecolor, fillcolor=fillcolor, outlinewidth=outlinewidth)
+            elif geotype == "MultiPoint":
+                if self.coordmode:
+                    coords = self.crs.coords2pixels(coords)
+                for point in coords:
+                    self._drawcircle(*point, fillsize=fillsize, outlinecolor=outlinecolor, fillcolor=fillcolor, outlinewidth=outlinewidth)
+            elif geotype == "LineString":
+                if self.coordmode:
+                    coords = self.crs.coords2pixels(coords)
+                self._drawmultiline(coords, fillcolor=fillcolor, outlinecolor=outlinecolor, fillsize=fillsize, outlinewidth=outlinewidth, joinstyle=joinstyle)
+            elif geotype == "MultiLineString":
+                if self.coordmode:
+                    coords = (self.crs.coords2pixels(eachmulti) for eachmulti in coords)
+                for eachmulti in coords:
+                    self._drawmultiline(eachmulti, fillcolor=fillcolor, outlinecolor=outlinecolor, fillsize=fillsize, outlinewidth=outlinewidth, joinstyle=joinstyle)
+            elif geotype == "Polygon":
+                if self.coordmode:
+                    coords = [self.crs.coords2pixels(polyorhole) for polyorhole in coords]
+                exterior = coords[0]
                 interiors = []
-                if len(eachmulti) > 1:
-                    interiors.extend(eachmulti[1:])
+                if len(coords) > 1:
+                    interiors.extend(coords[1:])
                 self._drawpolygon(exterior, holes=interiors, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth, outlinejoinstyle=outlinejoinstyle)
+            elif geotype == "MultiPolygon":
+                if self.coordmode:
+                    coords = ([self.crs.coords2pixels(polyorhole) for polyorhole in eachmulti] for eachmulti in coords)
+                for eachmulti in coords:
+                    exterior = eachmulti[0]
+                    interiors = []
+                    if len(eachmulti) > 1:
+                        interiors.extend(eachmulti[1:])
+                    self._drawpolygon(exterior, holes=interiors, fillcolor=fillcolor, outlinecolor=outlinecolor, outlinewidth=outlinewidth, outlinejoinstyle=outlinejoinstyle)
     
+    def drawtiled(self, drawcalls, tilesize=256, processes=None):
+        """
+        Draws many shapes at once by splitting the image into square tiles
+        and drawing the shapes of each tile in parallel in separate processes,
+        which is much faster for large images with many shapes on multicore machines.
+        Looks the same as calling each of the draw methods one after another, but
+        since each tile draws in its own pixel offsets, the floating point math may
+        round some antialiased pixels differently by one color step.
+
+        | **option** | **description**
+        | --- | --- 
+        | drawcalls | list of (methodname, options) tuples in the order they should be drawn, where methodname is "drawline", "drawpolygon", "drawmultiline", "drawcircle" or "drawgeojson", and options is a dictionary of arguments to that method. The drawcalls of a DisplayList can also be given.
+        | *tilesize | the width and height of each tile in pixels, default is 256
+        | *processes | how many processes to draw with, default is the number of CPUs. Set to 1 to draw tile by tile in the current process.
+        """
+        #collect the polygons and thin lines that each draw call is made of,
+        #so that the bbox of each includes eg the spikes of miter joins
+        recorder = _PolygonRecorder(self)
+        for methodname,options in drawcalls:
+            if methodname not in ("drawline","drawpolygon","drawmultiline","drawcircle","drawgeojson"):
+                raise ValueError("drawtiled does not support the %s method" % methodname)
+            getattr(recorder, methodname)(**options)
+        #bin each shape into all tiles its bbox touches
+        tileshapes = dict()
+        for shape in recorder.shapes:
+            if shape[0] == "_blended":
+                raise ValueError("drawtiled does not support blend modes")
+            xmin,ymin,xmax,ymax = _shapebbox(shape)
+            xmin,ymin = max(int(xmin)//tilesize,0),max(int(ymin)//tilesize,0)
+            xmax,ymax = min(int(xmax)//tilesize,(self.width-1)//tilesize),min(int(ymax)//tilesize,(self.height-1)//tilesize)
+            for tiley in xrange(ymin,ymax+1):
+                for tilex in xrange(xmin,xmax+1):
+                    tileshapes.setdefault((tilex,tiley), []).append(shape)
+        #send each tile with a small border so that antialiased pixels are not lost at its edges
+        pad = 2
+        tasks = []
+        for (tilex,tiley),shapes in tileshapes.items():
+            x1,y1 = max(tilex*tilesize-pad,0),max(tiley*tilesize-pad,0)
+            x2,y2 = min((tilex+1)*tilesize+pad,self.width),min((tiley+1)*tilesize+pad,self.height)
+            rows = [list(self.imagegrid[y][x1:x2]) for y in xrange(y1,y2)]
+            tasks.append((tilex*tilesize-x1, tiley*tilesize-y1, x1, y1, tilesize, self.mode, self.supersample, self.linearblend, rows, shapes))
+        pool = None
+        if processes == 1:
+            results = itertools.imap(_drawtile, tasks)
+        else:
+            pool = multiprocessing.Pool(processes)
+            results = pool.imap_unordered(_drawtile, tasks)
+        try:
+            #stitch the tiles back into the image
+            for x,y,rows in results:
+                for rowindex,row in enumerate(rows):
+                    self.imagegrid[y+rowindex][x:x+len(row)] = row
+                self._dirty[y:y+len(rows)] = b"\x01"*len(rows)
+        finally:
+            #all tiles are done by now, unless one failed and the rest are not needed
+            if pool:
+                pool.terminate()
+                pool.join()
+
     def floodfill(self,x,y,fillcolor,fuzzythresh=1.0):
         """
         Fill a large area of similarly colored neighboring pixels to the color at the origin point.
@@ -958,6 +1204,90 @@ class Image(object):
             theStack.append( (x, y + 1) )  # down
             theStack.append( (x, y - 1) )  # up
 
+    #STATISTICS
+    def startstats(self, callback=None):
+        """
+        Starts collecting statistics about the drawing done on the image, eg to find out
+        where rendering time goes. Collecting statistics makes drawing somewhat slower,
+        but costs nothing while turned off. The statistics are in the .stats
+        dictionary of the image, with these entries:
+
+        | **key** | **description**
+        | --- | --- 
+        | pixels | the number of whole pixels written with a solid color
+        | blended | the number of whole pixels written with a transparent color, blended with the existing color
+        | subpixels | the number of points at floating point positions, each spread over up to four pixels, which are not counted again as blended
+        | polygons | the number of polygons filled or outlined, including those that thick lines, joins and circles are drawn as
+        | edges | the number of polygon and hole edges in those polygons
+        | beziervertices | the number of vertices generated for bezier curves, round caps, round joins and circles
+        | spans | the number of image rows copied or blended a whole row at a time, by paste and blend modes
+        | calls | a dictionary of how many times each draw method was called
+        | time | a dictionary of the total seconds spent in each draw method
+
+        A draw method called from within another, eg paste by pastedata, is counted
+        and timed only as part of the outer one, so the times do not overlap.
+        Calling startstats again while collecting starts over from zero.
+        When supersampling, the pixels counted are those of the supersampled buffer.
+
+        | **option** | **description**
+        | --- | --- 
+        | *callback | a function to call after each draw method with the name of the method, the seconds it took, and the stats dictionary
+        """
+        self._statscallback = callback
+        if self._stats is not None:
+            #already collecting, only reset the counts
+            stats = self._stats
+            stats.update(pixels=0, blended=0, subpixels=0, polygons=0, edges=0, beziervertices=0, spans=0, calls=dict(), time=dict())
+            return
+        self.stats = self._stats = dict(pixels=0, blended=0, subpixels=0, polygons=0, edges=0, beziervertices=0, spans=0, calls=dict(), time=dict())
+        #count pixel writes by putting a counting _put in front of the normal one
+        stats = self._stats
+        put = self._put
+        def countingput(x, y, color):
+            if isinstance(x, float) or isinstance(y, float):
+                stats["subpixels"] += 1
+            elif len(color) == 4:
+                stats["blended"] += 1
+            else:
+                stats["pixels"] += 1
+            put(x, y, color)
+        self._put = countingput
+        #time the draw methods the same way, but only the outermost one
+        depth = [0]
+        def timed(methodname):
+            method = getattr(self, methodname)
+            def timedmethod(*args, **kwargs):
+                if depth[0]:
+                    return method(*args, **kwargs)
+                depth[0] += 1
+                start = time.time()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    depth[0] -= 1
+                    elapsed = time.time() - start
+                    stats["calls"][methodname] = stats["calls"].get(methodname, 0) + 1
+                    stats["time"][methodname] = stats["time"].get(methodname, 0) + elapsed
+                    if self._statscallback:
+                        self._statscallback(methodname, elapsed, stats)
+            return timedmethod
+        for methodname in ("drawline","drawmultiline","drawbezier","drawarc","drawcircle","drawsquare",
+                           "drawpolygon","drawrectangle","drawgridticks","drawgeojson","drawtiled","floodfill","paste","pastedata"):
+            setattr(self, methodname, timed(methodname))
+
+    def stopstats(self):
+        """
+        Stops collecting statistics, and returns the statistics dictionary.
+        """
+        stats = self._stats
+        for methodname in ("_put","drawline","drawmultiline","drawbezier","drawarc","drawcircle","drawsquare",
+                           "drawpolygon","drawrectangle","drawgridticks","drawgeojson","drawtiled","floodfill","paste","pastedata"):
+            self.__dict__.pop(methodname, None)
+        if self.mode == "RGBA":
+            self._put = self._putpremultiplied
+        self._stats = None
+        return stats
+
     #AFTERMATH
     def view(self):
         """
@@ -966,13 +1296,15 @@ class Image(object):
         window = tk.Tk()
         canvas = tk.Canvas(window, width=self.width, height=self.height)
         canvas.create_text((self.width/2, self.height/2), text="error\nviewing\nimage")
+        self._tkphoto = None #a new window cannot reuse the old photoimage
         self.tkimg = self._tkimage()
         canvas.create_image((self.width/2, self.height/2), image=self.tkimg, state="normal")
         canvas.pack()
         tk.mainloop()
     def updateview(self):
         """
-        Updates the image in the Tkinter window to include recent changes to the image
+        Updates the image in the Tkinter window to include recent changes to the image.
+        Only the rows that changed since the last view are sent to Tkinter.
         """
         self.tkimg = self._tkimage()
     def save(self, savepath):
@@ -981,19 +1313,396 @@ class Image(object):
 
         | **option** | **description**
         | --- | --- 
-        | filepath | the string path location to save the image. Extension must be given and can only be ".gif".
+        | filepath | the string path location to save the image. Extension must be given and can be ".png", ".gif", ".bmp", ".ppm" or ".pam".
         
         """
-        if savepath.endswith(".png"):
-            imagerows = [list(itertools.chain.from_iterable(row)) for row in self.imagegrid]
-            png.from_array(imagerows, mode="RGB").save(savepath)
-        elif savepath.endswith(".gif"):
-            tempwin = tk.Tk() #only so dont get "too early to create image" error
-            tkimg = self._tkimage()
-            tkimg.write(savepath, "gif")
-            tempwin.destroy()
+        fileformat = os.path.splitext(savepath)[1][1:]
+        if fileformat in ("png","gif","bmp","ppm","pam"):
+            with open(savepath, "wb") as fileobj:
+                self._encode(fileobj, fileformat)
+    def iterencode(self, fileformat="png", bandheight=64):
+        """
+        Encodes the image to file bytes piece by piece, yielding the header and then
+        the bytes of each band of rows as soon as it is encoded, eg to stream the image
+        to a client without holding the whole file in memory.
+        GIF images are compressed as a whole, and come in one piece.
+
+        | **option** | **description**
+        | --- | --- 
+        | *fileformat | the format to encode to, "png", "gif", "bmp", "ppm" or "pam"
+        | *bandheight | how many rows to encode at a time, default is 64
         
+        """
+        alpha = self.mode == "RGBA"
+        if fileformat == "png":
+            writer = png.Writer(self.width, self.height, alpha=alpha)
+            for data in writer.iterwrite(self._outputrows(self.imagegrid), bandheight):
+                yield data
+        elif fileformat == "gif":
+            fileobj = io.BytesIO()
+            gif.Writer(self.width, self.height, alpha=alpha).write(fileobj, self._outputrows(self.imagegrid))
+            yield fileobj.getvalue()
+        elif fileformat == "bmp":
+            #bmp rows are stored bottom-up
+            writer = bmp.Writer(self.width, self.height, alpha=alpha)
+            for data in writer.iterwrite(self._outputrows(reversed(self.imagegrid)), bandheight):
+                yield data
+        elif fileformat in ("ppm","pam"):
+            #raw pixel values after the header
+            planes = 4 if alpha else 3
+            if planes == 4 and fileformat == "ppm":
+                raise ValueError("PPM cannot store transparency, use .pam instead")
+            fileobj = io.BytesIO()
+            png.write_pnm_header(fileobj, self.width, self.height, planes, 255, pam=fileformat == "pam")
+            yield fileobj.getvalue()
+            for bandy in xrange(0, self.height, bandheight):
+                band = self._outputrows(self.imagegrid[bandy:bandy+bandheight])
+                yield array.array("B", itertools.chain.from_iterable(band)).tostring()
+        else:
+            raise ValueError("cannot encode to the %s format" % fileformat)
+
+    #ASYNCHRONOUS
+    def render_async(self, drawcalls):
+        """
+        Draws a list of draw calls in a background thread without blocking the asyncio
+        event loop, and returns a future to await, eg "await img.render_async(drawcalls)".
+        Don't draw on or encode the image in other ways until the future is done.
+
+        | **option** | **description**
+        | --- | --- 
+        | drawcalls | list of (methodname, options) tuples in the order they should be drawn, where methodname is a draw method and options a dictionary of arguments to that method. Can also be a DisplayList instance.
+
+        The executor and how many jobs may run at once are set by the ASYNC_EXECUTOR
+        and ASYNC_MAXJOBS module variables. Jobs beyond the limit wait their turn
+        without blocking the event loop, and once ASYNC_MAXWAITING jobs are waiting
+        further calls raise a RuntimeError, eg for the server to answer as busy.
+        Requires the asyncio module (or its Python 2 backport trollius), without it
+        iterencode streams the encoded image just the same, only synchronously.
+        """
+        if isinstance(drawcalls, DisplayList):
+            return _runasync(drawcalls.replay, self)
+        def render():
+            for methodname,options in drawcalls:
+                getattr(self, methodname)(**options)
+        return _runasync(render)
+
+    def encode_async(self, fileformat="png", onchunk=None):
+        """
+        Encodes the image to file bytes in a background thread without blocking the
+        asyncio event loop, and returns a future of the bytes to await,
+        eg "data = await img.encode_async('png')".
+
+        | **option** | **description**
+        | --- | --- 
+        | *fileformat | the format to encode to, "png", "gif", "bmp", "ppm" or "pam"
+        | *onchunk | a function to call with each band of bytes as soon as it is encoded, eg to stream the image to a client before the whole image is done. It is called in the event loop. The bytes are then not kept, and the future gives their total length instead.
+
+        The bands are made by iterencode. While ASYNC_MAXCHUNKS of them wait to be
+        handed to onchunk the encoding pauses, so a slow client holds back the
+        encoder instead of piling up bytes. The same limits apply as for render_async.
+        """
+        if fileformat not in ("png","gif","bmp","ppm","pam"):
+            raise ValueError("cannot encode to the %s format" % fileformat)
+        if not onchunk:
+            return _runasync(lambda: b"".join(self.iterencode(fileformat)))
+        asyncio = _importasyncio()
+        fileobj = _ChunkWriter(asyncio.get_event_loop(), onchunk)
+        def encode():
+            for data in self.iterencode(fileformat):
+                fileobj.write(data)
+            return fileobj.size
+        return _runasync(encode)
+
+
     #INTERNAL USE ONLY
+    @contextlib.contextmanager
+    def _blendlayer(self, blendmode):
+        """
+        The shapes drawn within this context are recorded instead, and then drawn
+        onto a transparent scratch layer just big enough for them, whose changed
+        rows are blended onto the image with the row kernel of the blend mode.
+        The layer is thrown away again afterwards.
+        When supersampling, the shapes are drawn onto the layer through a
+        supersampled buffer, see _supersample.
+        For internal use only.
+        """
+        if blendmode == "normal" and (self.supersample == 1 or self._recording):
+            #nothing to do, or already within a recording context
+            yield
+            return
+        kernel,unbounded = _blendkernel(blendmode, self.mode, self.linearblend)
+        #catch the shapes before they are drawn
+        recorder = _ShapeRecorder(self)
+        for methodname in ("_drawline","_drawpolygon","_drawmultiline","_drawcircle"):
+            setattr(self, methodname, getattr(recorder, methodname))
+        self._recording = True
+        try:
+            yield
+        finally:
+            for methodname in ("_drawline","_drawpolygon","_drawmultiline","_drawcircle"):
+                del self.__dict__[methodname]
+            self._recording = False
+        shapes = recorder.shapes
+        x1 = y1 = x2 = y2 = 0
+        if shapes:
+            bboxes = [_shapebbox(shape) for shape in shapes]
+            x1 = max(int(math.floor(min(bbox[0] for bbox in bboxes))), 0)
+            y1 = max(int(math.floor(min(bbox[1] for bbox in bboxes))), 0)
+            x2 = min(int(math.ceil(max(bbox[2] for bbox in bboxes)))+1, self.width)
+            y2 = min(int(math.ceil(max(bbox[3] for bbox in bboxes)))+1, self.height)
+        if x1 >= x2 or y1 >= y2:
+            if not unbounded:
+                return
+            x1 = y1 = x2 = y2 = 0
+            bands = []
+        else:
+            layer = Image(x2-x1, y2-y1, mode="RGBA", linearblend=self.linearblend)
+            with self._countstats(layer):
+                if self.supersample > 1:
+                    self._supersample(shapes, layer, x1, y1)
+                else:
+                    for shape in shapes:
+                        _drawshape(layer, shape, x1, y1)
+            bands = [(starty+y1, stopy+y1) for starty,stopy in layer.popdirtyrows()]
+        if unbounded:
+            #rows outside the shapes change too
+            blank = [(0,0,0,0)] * self.width
+            for y in xrange(self.height):
+                row = self.imagegrid[y]
+                layerrow = blank[:x1] + layer.imagegrid[y-y1] + blank[x2:] if y1 <= y < y2 else blank
+                row[:] = kernel(row, layerrow)
+            bands = [(0, self.height)]
+        else:
+            for starty,stopy in bands:
+                for y in xrange(starty, stopy):
+                    row = self.imagegrid[y]
+                    row[x1:x2] = kernel(row[x1:x2], layer.imagegrid[y-y1])
+        for starty,stopy in bands:
+            self._dirty[starty:stopy] = b"\x01" * (stopy - starty)
+            if self._stats is not None:
+                self._stats["spans"] += stopy - starty
+    @contextlib.contextmanager
+    def _countstats(self, img, keys=None):
+        """
+        Adds the counts of the drawing done on another image within this context,
+        eg on a scratch layer, to the statistics of this image, if collecting them.
+        Only the given keys are added, or all counts if None.
+        For internal use only.
+        """
+        if self._stats is None:
+            yield
+            return
+        img.startstats()
+        try:
+            yield
+        finally:
+            stats = img.stopstats()
+            for key in keys or ("pixels","blended","subpixels","polygons","edges","beziervertices"):
+                self._stats[key] += stats[key]
+    def _fillpolygon(self, rings, fillcolor, fillrule="evenodd"):
+        """
+        Fills the area enclosed by closed rings of pixel coordinates, the first being the
+        exterior and the rest holes, with antialiasing by exact pixel coverage.
+        Like font rasterizers, each edge adds its signed area and cover to the cells of a
+        row buffer, one row at a time, and a running sum over the row then gives the
+        winding number of each pixel, with fractions at the edges.
+        For internal use only.
+        """
+        if fillrule not in ("evenodd","nonzero"):
+            raise ValueError("fillrule must be evenodd or nonzero, not %s" % fillrule)
+        if fillrule == "nonzero" and len(rings) > 1:
+            #wind the holes against the exterior so that they stay empty
+            def signedarea(ring):
+                return sum(x1*y2-x2*y1 for (x1,y1),(x2,y2) in itertools.izip(ring, ring[1:]))
+            direction = signedarea(rings[0]) > 0
+            rings = [rings[0]] + [ring[::-1] if (signedarea(ring) > 0) == direction else ring for ring in rings[1:]]
+        #edges as x0,y0,x1,y1,dxdy,direction with y0 < y1, moved so that pixel centers are at halves
+        edges = []
+        xmin,ymin,xmax,ymax = self.width,self.height,0,0
+        for ring in rings:
+            for (x0,y0),(x1,y1) in itertools.izip(ring, itertools.chain(ring[1:], ring[:1])):
+                if y0 == y1:
+                    continue
+                direction = 1
+                if y0 > y1:
+                    x0,y0,x1,y1,direction = x1,y1,x0,y0,-1
+                x0,y0,x1,y1 = x0+0.5,y0+0.5,x1+0.5,y1+0.5
+                edges.append((y0, x0, y1, x1, (x1-x0)/float(y1-y0), direction))
+                xmin,xmax = min(xmin,x0,x1),max(xmax,x0,x1)
+                ymin,ymax = min(ymin,y0),max(ymax,y1)
+        if not edges:
+            return
+        edges.sort()
+        left,right = max(int(math.floor(xmin)),0),min(int(math.ceil(xmax)),self.width)
+        top,bottom = max(int(math.floor(ymin)),0),min(int(math.ceil(ymax)),self.height)
+        if left >= right or top >= bottom:
+            return
+        width = right - left
+        floor = math.floor
+        r,g,b = fillcolor[:3]
+        fillalpha = fillcolor[3] if len(fillcolor) == 4 else 255
+        solid = (r,g,b) if fillalpha >= 255 else (r,g,b,fillalpha)
+        evenodd = fillrule == "evenodd"
+        put = self._put
+        active = []
+        edgeindex = 0
+        for y in xrange(top, bottom):
+            #edges that reach into this row
+            while edgeindex < len(edges) and edges[edgeindex][0] < y+1:
+                active.append(edges[edgeindex])
+                edgeindex += 1
+            active = [edge for edge in active if edge[2] > y]
+            acc = [0.0] * (width+2)
+            touched = set()
+            for y0,x0,y1,x1,dxdy,direction in active:
+                ya,yb = max(y0,y),min(y1,y+1)
+                if yb <= ya:
+                    continue
+                d = (yb-ya)*direction
+                xa = x0 + (ya-y0)*dxdy - left
+                xb = x0 + (yb-y0)*dxdy - left
+                if xa > xb:
+                    xa,xb = xb,xa
+                if xa < 0 or xb > width:
+                    #split the edge where it leaves the canvas, the part left of it
+                    #counts as running down the left border and the part right of it not at all
+                    if xb <= 0:
+                        acc[0] += d
+                        touched.add(0)
+                        continue
+                    if xa >= width:
+                        continue
+                    dx = xb - xa
+                    if xa < 0:
+                        acc[0] += d*-xa/dx
+                    d *= (min(xb,width) - max(xa,0)) / dx
+                    xa,xb = max(xa,0),min(xb,width)
+                xafloor = floor(xa)
+                xai = int(xafloor)
+                xbi = int(math.ceil(xb))
+                touched.update(range(xai, max(xbi,xai+1)+1))
+                if xbi <= xai + 1:
+                    #within one cell, split the cover by the mid x
+                    xmid = 0.5*(xa+xb) - xafloor
+                    acc[xai] += d - d*xmid
+                    acc[xai+1] += d*xmid
+                else:
+                    #spread over several cells by the area under the edge
+                    slope = 1.0/(xb-xa)
+                    xafrac = xa - xafloor
+                    first = 0.5*slope*(1-xafrac)*(1-xafrac)
+                    xbfrac = xb - xbi + 1
+                    last = 0.5*slope*xbfrac*xbfrac
+                    acc[xai] += d*first
+                    if xbi == xai + 2:
+                        acc[xai+1] += d*(1 - first - last)
+                    else:
+                        second = slope*(1.5 - xafrac)
+                        acc[xai+1] += d*(second - first)
+                        step = d*slope
+                        for xi in range(xai+2, xbi-1):
+                            acc[xi] += step
+                        acc[xbi-1] += d*(1 - second - (xbi-xai-3)*slope - last)
+                    acc[xbi] += d*last
+            #resolve the row into pixels, the winding only changes at touched cells
+            #so the pixels up to the next touched cell all get the same color
+            cells = sorted(touched)
+            cells.append(width)
+            winding = 0.0
+            for xi,nextxi in itertools.izip(cells, cells[1:]):
+                if xi >= width:
+                    break
+                winding += acc[xi]
+                if -0.001 < winding < 0.001:
+                    continue
+                coverage = abs(winding)
+                if evenodd:
+                    coverage %= 2.0
+                    if coverage > 1.0:
+                        coverage = 2.0 - coverage
+                elif coverage > 1.0:
+                    coverage = 1.0
+                alpha = int(coverage*fillalpha + 0.5)
+                if alpha >= fillalpha:
+                    color = solid
+                elif alpha > 0:
+                    color = (r,g,b,alpha)
+                else:
+                    continue
+                for x in range(left+xi, left+min(nextxi,width)):
+                    put(x, y, color)
+    def _supersample(self, shapes, layer, x=0, y=0):
+        """
+        Draws shapes onto a transparent layer through a buffer with supersample
+        times supersample pixels for each pixel of the layer, which is then
+        downsampled by averaging each block of pixels. The layer starts at x,y
+        of the image, and may be smaller than it. Only the bbox of the shapes
+        is drawn, in bands of rows to keep the buffer small, and each band only
+        draws the shapes that reach into it.
+        For internal use only.
+        """
+        if not shapes:
+            return
+        factor = self.supersample
+        blocksize = factor*factor
+        bboxes = [_shapebbox(shape) for shape in shapes]
+        x1 = max(int(math.floor(min(bbox[0] for bbox in bboxes))), x)
+        y1 = max(int(math.floor(min(bbox[1] for bbox in bboxes))), y)
+        x2 = min(int(math.ceil(max(bbox[2] for bbox in bboxes)))+1, x+layer.width)
+        y2 = min(int(math.ceil(max(bbox[3] for bbox in bboxes)))+1, y+layer.height)
+        if x1 >= x2 or y1 >= y2:
+            return
+        bandheight = max(min(2**20 // ((x2-x1)*blocksize), y2-y1), 1)
+        #bin each shape into all bands its bbox touches
+        bandshapes = dict()
+        for shape,bbox in itertools.izip(shapes, bboxes):
+            first = max(int(math.floor(bbox[1]))-y1, 0) // bandheight
+            last = min(int(math.ceil(bbox[3]))-y1, y2-1-y1) // bandheight
+            for band in xrange(first, last+1):
+                #only the first band counts the polygons and vertices of the shape in the statistics
+                bandshapes.setdefault(band, []).append((shape, band == first))
+        for band,shapes in sorted(bandshapes.items()):
+            bandy = y1 + band*bandheight
+            bandstop = min(bandy+bandheight, y2)
+            buff = Image((x2-x1)*factor, (bandstop-bandy)*factor, mode="RGBA", linearblend=self.linearblend)
+            for shape,first in shapes:
+                with self._countstats(buff, None if first else ("pixels","blended","subpixels")):
+                    _drawshape(buff, shape, x1, bandy, factor)
+            #box filter each block of rows and then each block of pixels in them
+            for rowy in xrange(bandy, bandstop):
+                rows = buff.imagegrid[(rowy-bandy)*factor:(rowy-bandy+1)*factor]
+                if self.linearblend:
+                    rows = [list(itertools.chain.from_iterable(itertools.imap(_linearpremultiplied, row))) for row in rows]
+                else:
+                    rows = [list(itertools.chain.from_iterable(row)) for row in rows]
+                sums = rows[0]
+                for row in rows[1:]:
+                    sums = map(operator.add, sums, row)
+                channels = [[(sum(values[start:start+factor]) + blocksize//2) // blocksize
+                             for start in xrange(0, len(values), factor)]
+                            for values in (sums[0::4],sums[1::4],sums[2::4],sums[3::4])]
+                if self.linearblend:
+                    layer.imagegrid[rowy-y][x1-x:x2-x] = [_srgbpremultiplied(color) for color in zip(*channels)]
+                else:
+                    layer.imagegrid[rowy-y][x1-x:x2-x] = zip(*channels)
+            layer._dirty[bandy-y:bandstop-y] = b"\x01" * (bandstop - bandy)
+    def _beziercoords(self, xypoints, intervals=100):
+        coords = _Bezier(xypoints, intervals).coords
+        if self._stats is not None:
+            self._stats["beziervertices"] += len(coords)
+        return coords
+    def _encode(self, fileobj, fileformat):
+        for data in self.iterencode(fileformat):
+            fileobj.write(data)
+    def _outputrows(self, rows):
+        """
+        Goes through the given image rows as lists of flat color values for the file writers.
+        Premultiplied RGBA pixels are turned back into normal RGBA values.
+        For internal use only.
+        """
+        if self.mode == "RGBA":
+            return (list(itertools.chain.from_iterable(itertools.imap(_unpremultiply, row))) for row in rows)
+        return (list(itertools.chain.from_iterable(row)) for row in rows)
     def _loadimage(self, filepath=None, data=None):
         if filepath:
             if filepath.endswith(".png"):
@@ -1010,35 +1719,1007 @@ class Image(object):
                     index = 0
                     while index < width*colorlength:
                         color = [pxlrow[index+spectrum] for spectrum in xrange(colorlength)]
-                        color = color[:3] #this bc currently no support for alpha image values
+                        if self.mode == "RGB":
+                            color = color[:3] #drop alpha values unless the image has transparency
                         row.append(color)
                         index += colorlength
                     data.append(row)
                 self.width,self.height = width,height
                 self.imagegrid = data
-            elif filepath.endswith(".gif"):
-                #GIF
-                tempwin = tk.Tk()
-                tempimg = tk.PhotoImage(file=filepath)
-                data = [[tuple([int(spec) for spec in tempimg._get(x,y).split()])
-                        for x in xrange(tempimg.width())]
-                        for y in xrange(tempimg.height())]
-                self.width = len(data[0])
-                self.height = len(data)
+            elif filepath.endswith(".gif") or filepath.endswith(".bmp"):
+                #GIF or BMP
+                if filepath.endswith(".gif"):
+                    reader = gif.Reader(filename=filepath)
+                else:
+                    reader = bmp.Reader(filename=filepath)
+                width,height,pixels,metadata = reader.read()
+                if metadata["alpha"]:
+                    colorlength = 4
+                else:
+                    colorlength = 3
+                channels = colorlength if self.mode == "RGBA" else 3 #drop alpha values unless the image has transparency
+                data = [zip(*[pxlrow[channel::colorlength] for channel in xrange(channels)])
+                        for pxlrow in pixels]
+                self.width,self.height = width,height
+                self.imagegrid = data
+            elif filepath.endswith(".ppm") or filepath.endswith(".pam"):
+                #PPM or PAM, the raw pixel values are read in one go
+                with open(filepath, "rb") as fileobj:
+                    _,width,height,depth,maxval = png.read_pnm_header(fileobj, supported=("P5","P6","P7"))
+                    if depth > 4:
+                        raise ValueError("PAM images with more than 4 channels are not supported")
+                    samplesize = 1 if maxval <= 255 else 2
+                    rowsize = width*depth
+                    pixels = bytearray(rowsize*height*samplesize)
+                    if fileobj.readinto(pixels) != len(pixels):
+                        raise IOError("PPM/PAM pixel data is too short")
+                if samplesize == 2 or maxval != 255:
+                    #rescale to 8 bits
+                    if samplesize == 2:
+                        values = array.array("H", bytes(pixels))
+                        if sys.byteorder == "little":
+                            values.byteswap()
+                    else:
+                        values = pixels
+                    pixels = bytearray([value*255//maxval for value in values])
+                if depth <= 2:
+                    #greyscale
+                    data = [[(value,value,value) for value in pixels[start:start+rowsize:depth]]
+                            for start in xrange(0, rowsize*height, rowsize)]
+                else:
+                    channels = depth if self.mode == "RGBA" else 3 #drop alpha values unless the image has transparency
+                    data = [zip(*[pixels[start+channel:start+rowsize:depth] for channel in xrange(channels)])
+                            for start in xrange(0, rowsize*height, rowsize)]
+                self.width,self.height = width,height
                 self.imagegrid = data
         elif data:
             self.width = len(data[0])
             self.height = len(data)
             self.imagegrid = data
+        if self.mode == "RGBA":
+            #loaded colors are RGB or RGBA, store them premultiplied
+            self.imagegrid = [[_premultiply(color) for color in row] for row in self.imagegrid]
     def _tkimage(self):
         """
         Converts the image pixel matrix to a Tkinter Photoimage to allow viewing/saving.
+        The pixels are handed over as binary PPM data instead of a string of hex colors.
+        The Photoimage is kept and reused on later calls, with only the dirty rows
+        being put again.
         For internal use only.
         """
-        tkimg = tk.PhotoImage(width=self.width, height=self.height)
-        imgstring = " ".join(["{"+" ".join(["#%02x%02x%02x" %tuple(rgb) for rgb in horizline])+"}" for horizline in self.imagegrid])
-        tkimg.put(imgstring)
+        bands = self.popdirtyrows("view")
+        tkimg = getattr(self, "_tkphoto", None)
+        if tkimg is None or tkimg.width() != self.width or tkimg.height() != self.height:
+            rows = [self._rgbbytes(horizline) for horizline in self.imagegrid]
+            tkimg = tk.PhotoImage(data=self._ppmdata(rows), format="PPM")
+        else:
+            #put each band of changed rows in one go
+            for starty,stopy in bands:
+                rows = [self._rgbbytes(self.imagegrid[y]) for y in xrange(starty,stopy)]
+                tkimg.tk.call(tkimg, "put", self._ppmdata(rows), "-format", "PPM", "-to", 0, starty)
+        self._tkphoto = tkimg
         return tkimg
+    def _rgbbytes(self, horizline):
+        """
+        The RGB bytes of a row of pixels, for RGBA images the premultiplied
+        color values, which is how they look when drawn on black.
+        For internal use only.
+        """
+        if self.mode == "RGBA":
+            return bytearray(itertools.chain.from_iterable(color[:3] for color in horizline))
+        return bytearray(itertools.chain.from_iterable(horizline))
+    def _ppmdata(self, rows):
+        """
+        Packs rows of RGB bytes into base64 encoded binary PPM data
+        that can be given to a Tkinter Photoimage.
+        For internal use only.
+        """
+        header = ("P6 %d %d 255\n" % (self.width, len(rows))).encode("ascii")
+        return base64.b64encode(bytes(header + bytearray().join(rows))).decode("ascii")
+
+class MappedImage(Image):
+    def __init__(self, filepath, width=None, height=None, background=None, crs=None, supersample=1, linearblend=False):
+        """
+        An image whose pixels are kept in a memory-mapped raw file instead
+        of in memory, so that very large images can be drawn on while the
+        operating system pages rows in and out, and so that several
+        processes can draw on different regions of the same image.
+        Otherwise used just like the normal Image class.
+
+        The file is a binary PPM image, so it can also be opened as a
+        normal image once done. If the file does not exist yet it is
+        created with the given width and height, otherwise the existing
+        file is opened and its size is used. Several processes may open
+        the same new file at once, only one of them creates it.
+
+        | **option** | **description**
+        | --- | --- 
+        | filepath | the string path of the ".ppm" file backing the image
+        | *width/height | the size of the image in pixels, integers, only needed when creating a new file
+        | *background | an RGB color tuple to fill a new file with, default is white/grayish. Black leaves the new file empty, which is fastest.
+        | *crs | a coordinate system instance, see the Image class
+        | *supersample/linearblend | the antialiasing settings, see the Image class
+
+        Changes are written to the file by the operating system in its
+        own time, use the flush method to make sure they are written,
+        and close when done.
+        """
+        #the pixels are not kept in memory, so the rest of Image.__init__ does not apply
+        self.mode = "RGB"
+        self.supersample = supersample
+        self.linearblend = linearblend
+        if not os.path.exists(filepath):
+            self._createfile(filepath, width, height, background)
+        self._file = open(filepath, "r+b")
+        _,width,height,depth,maxval = png.read_pnm_header(self._file, supported=("P6",))
+        if maxval != 255:
+            raise ValueError("only 8 bit PPM files can be memory-mapped")
+        self._offset = self._file.tell()
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self.width = width
+        self.height = height
+        self.imagegrid = _MappedGrid(self._map, self._offset, width, height)
+        self._dirty = bytearray(height)
+        self._dirtyviews = dict()
+        #set coordinate system
+        self.crs = crs
+        if crs:
+            crs.bindimage(img=self)
+            self.coordmode = True
+        else:
+            self.coordmode = False
+
+    def _createfile(self, filepath, width, height, background):
+        """
+        Writes a new PPM file filled with the background color. It is written under
+        a unique temporary name first and then linked to the filepath, which fails if
+        another process created the file in the meantime, so that no process ever
+        opens a half written file.
+        For internal use only.
+        """
+        if not background:
+            background = (200,200,200)
+        filedir = os.path.dirname(os.path.abspath(filepath))
+        fd,temppath = tempfile.mkstemp(suffix=".ppm", dir=filedir)
+        try:
+            with os.fdopen(fd, "wb") as fileobj:
+                png.write_pnm_header(fileobj, width, height, 3, 255)
+                rowbytes = array.array("B", background) * width
+                if tuple(background) == (0,0,0):
+                    fileobj.seek(width*height*3 - 1, 1)
+                    fileobj.write(b"\x00")
+                else:
+                    for _ in xrange(height):
+                        rowbytes.tofile(fileobj)
+            #rename does not replace existing files on Windows, where there is no link
+            link = getattr(os, "link", os.rename)
+            try:
+                link(temppath, filepath)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+                #created by another process first, use theirs
+        finally:
+            if os.path.exists(temppath):
+                os.remove(temppath)
+
+    def flush(self):
+        """
+        Makes sure all changes so far are written to the file.
+        """
+        self._map.flush()
+
+    def close(self):
+        """
+        Writes all changes to the file and closes it.
+        The image can no longer be used afterwards.
+        """
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+    def _get(self,x,y):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise IndexError("pixel outside image")
+        return struct.unpack_from("BBB", self._map, self._offset + (y*self.width + x)*3)
+
+    def _put(self, x,y,color):
+        #write whole solid pixels directly, leave the rest to the normal drawing
+        if len(color) == 3 and not isinstance(x, float) and not isinstance(y, float):
+            if 0 <= x < self.width and 0 <= y < self.height:
+                r,g,b = color
+                struct.pack_into("BBB", self._map, self._offset + (y*self.width + x)*3, int(r), int(g), int(b))
+                self._dirty[y] = 1
+            return
+        Image._put(self, x, y, color)
+
+class _MappedGrid(object):
+    """
+    Looks like the list of rows of RGB tuples of a normal image,
+    but reads and writes a memory-mapped buffer.
+    For internal use only.
+    """
+    def __init__(self, buf, offset, width, height):
+        self.buf = buf
+        self.offset = offset
+        self.width = width
+        self.height = height
+    def __len__(self):
+        return self.height
+    def __getitem__(self, y):
+        if y < 0:
+            y += self.height
+        if not 0 <= y < self.height:
+            raise IndexError("row outside image")
+        return _MappedRow(self.buf, self.offset + y*self.width*3, self.width)
+    def __iter__(self):
+        for y in range(self.height):
+            yield self[y]
+
+class _MappedRow(object):
+    """
+    One row of a _MappedGrid, reading and writing RGB tuples.
+    For internal use only.
+    """
+    def __init__(self, buf, start, width):
+        self.buf = buf
+        self.start = start
+        self.width = width
+    def __len__(self):
+        return self.width
+    def __getitem__(self, x):
+        if isinstance(x, slice):
+            #only unpack the bytes of the pixels in the slice
+            start,stop,step = x.indices(self.width)
+            if step < 0:
+                return self[stop+1:start+1][::-1][::-step]
+            if stop <= start:
+                return []
+            values = struct.unpack_from("%dB" % ((stop-start)*3), self.buf, self.start + start*3)
+            return zip(values[0::3*step], values[1::3*step], values[2::3*step])
+        if x < 0:
+            x += self.width
+        if not 0 <= x < self.width:
+            raise IndexError("pixel outside image")
+        return struct.unpack_from("BBB", self.buf, self.start + x*3)
+    def __setitem__(self, x, color):
+        if isinstance(x, slice):
+            #a run of colors, written at once
+            start,stop,step = x.indices(self.width)
+            if step != 1 or stop - start != len(color):
+                raise ValueError("can only replace a run of pixels with as many colors")
+            values = [int(spec) for rgb in color for spec in rgb[:3]]
+            struct.pack_into("%dB" % len(values), self.buf, self.start + start*3, *values)
+            return
+        if x < 0:
+            x += self.width
+        if not 0 <= x < self.width:
+            raise IndexError("pixel outside image")
+        r,g,b = color[:3]
+        struct.pack_into("BBB", self.buf, self.start + x*3, int(r), int(g), int(b))
+    def __iter__(self):
+        values = struct.unpack_from("%dB" % (self.width*3), self.buf, self.start)
+        return iter(zip(values[0::3], values[1::3], values[2::3]))
+
+class DisplayList(object):
+    def __init__(self):
+        """
+        Records draw calls instead of drawing them, so that the same drawing
+        can be replayed onto any number of images, eg the same map layers
+        for many different tiles and zoom levels.
+        Has the same draw methods as the Image class (except floodfill),
+        taking the same arguments.
+
+        The display list can be pickled, eg to send it to other processes.
+        Geojson objects are recorded by their __geo_interface__ dictionary.
+        """
+        self.drawcalls = []
+        self._shapes = dict()
+        self._hash = None
+
+    def drawline(self, *args, **options):
+        self._record("drawline", args, options)
+    def drawmultiline(self, *args, **options):
+        self._record("drawmultiline", args, options)
+    def drawbezier(self, *args, **options):
+        self._record("drawbezier", args, options)
+    def drawarc(self, *args, **options):
+        self._record("drawarc", args, options)
+    def drawcircle(self, *args, **options):
+        self._record("drawcircle", args, options)
+    def drawsquare(self, *args, **options):
+        self._record("drawsquare", args, options)
+    def drawpolygon(self, *args, **options):
+        self._record("drawpolygon", args, options)
+    def drawrectangle(self, *args, **options):
+        self._record("drawrectangle", args, options)
+    def drawgeojson(self, *args, **options):
+        self._record("drawgeojson", args, options)
+
+    def replay(self, img, crs=None):
+        """
+        Draws all the recorded draw calls onto an image, in the order they were recorded.
+        The coordinates are converted to pixels only the first time the display list is
+        replayed onto an image of a given size and coordinate system, and then reused.
+
+        | **option** | **description**
+        | --- | --- 
+        | img | the image instance to draw on
+        | *crs | a coordinate system instance to use instead of the one of the image, if any
+        """
+        if not crs and img.coordmode:
+            crs = img.crs
+        if crs:
+            crs.bindimage(img=img)
+            key = (img.width, img.height, crs.xleft, crs.ytop, crs.xright, crs.ybottom)
+        else:
+            key = (img.width, img.height)
+        shapes = self._shapes.get(key)
+        if shapes is None:
+            recorder = _ShapeRecorder(img)
+            recorder.crs = crs
+            recorder.coordmode = bool(crs)
+            for methodname,options in self.drawcalls:
+                getattr(recorder, methodname)(**options)
+            shapes = self._shapes[key] = recorder.shapes
+        for shape in shapes:
+            _drawshape(img, shape)
+
+    def contenthash(self):
+        """
+        Returns a hex string that is the same for all display lists with the
+        same draw calls, coordinates and styles, eg to use as a cache key.
+        """
+        if self._hash is None:
+            def canonical(obj):
+                #a repr that does not depend on dict order or object addresses
+                if isinstance(obj, _GeoInterface):
+                    obj = obj.__geo_interface__
+                if isinstance(obj, dict):
+                    return "{%s}" % ",".join("%r:%s" % (key, canonical(obj[key])) for key in sorted(obj))
+                elif isinstance(obj, (list,tuple)):
+                    return "[%s]" % ",".join(canonical(each) for each in obj)
+                else:
+                    return repr(obj)
+            self._hash = hashlib.sha1(canonical(self.drawcalls).encode("utf-8")).hexdigest()
+        return self._hash
+
+    #INTERNAL USE ONLY
+    def _record(self, methodname, args, options):
+        #name all arguments, so that drawcalls look like those for Image.drawtiled
+        argnames = inspect.getargspec(getattr(Image, methodname)).args[1:]
+        options.update(zip(argnames, args))
+        if methodname == "drawgeojson":
+            options["geojobj"] = _GeoInterface(options["geojobj"].__geo_interface__)
+        self.drawcalls.append((methodname, options))
+        self._shapes = dict()
+        self._hash = None
+    def __getstate__(self):
+        #the converted shapes are left out, they are quickly recreated
+        return {"drawcalls": self.drawcalls}
+    def __setstate__(self, state):
+        self.drawcalls = state["drawcalls"]
+        self._shapes = dict()
+        self._hash = None
+
+def _importasyncio():
+    """
+    Imports asyncio, or its backport trollius on Python 2.
+    For internal use only.
+    """
+    try:
+        import asyncio
+    except ImportError:
+        import trollius as asyncio
+    return asyncio
+
+_asyncjobs = dict(running=0, waiting=[], lock=threading.Lock())
+
+def _runasync(func, *args):
+    """
+    Runs a function in the ASYNC_EXECUTOR and returns a future of its result,
+    starting it only when fewer than ASYNC_MAXJOBS jobs are running.
+    Raises a RuntimeError if ASYNC_MAXWAITING jobs are already waiting.
+    For internal use only.
+    """
+    asyncio = _importasyncio()
+    loop = asyncio.get_event_loop()
+    future = asyncio.Future(loop=loop)
+    def start():
+        job = loop.run_in_executor(ASYNC_EXECUTOR, func, *args)
+        job.add_done_callback(finish)
+    def finish(job):
+        with _asyncjobs["lock"]:
+            if _asyncjobs["waiting"]:
+                #the next job takes over the place, in the event loop it was made in
+                nextloop,nextstart = _asyncjobs["waiting"].pop(0)
+                nextloop.call_soon_threadsafe(nextstart)
+            else:
+                _asyncjobs["running"] -= 1
+        if future.cancelled():
+            return
+        if job.exception() is not None:
+            future.set_exception(job.exception())
+        else:
+            future.set_result(job.result())
+    with _asyncjobs["lock"]:
+        if _asyncjobs["running"] < ASYNC_MAXJOBS:
+            _asyncjobs["running"] += 1
+        elif len(_asyncjobs["waiting"]) < ASYNC_MAXWAITING:
+            _asyncjobs["waiting"].append((loop, start))
+            return future
+        else:
+            raise RuntimeError("too many jobs, %s are already waiting" % ASYNC_MAXWAITING)
+    start()
+    return future
+
+class _ChunkWriter(object):
+    """
+    A file object that hands each written piece of bytes over to a function
+    in the event loop without keeping it. Writing blocks the encoding thread
+    while ASYNC_MAXCHUNKS pieces are still waiting to be handed over.
+    For internal use only.
+    """
+    def __init__(self, loop, onchunk):
+        self.loop = loop
+        self.onchunk = onchunk
+        self.pending = threading.Semaphore(ASYNC_MAXCHUNKS)
+        self.size = 0
+    def write(self, data):
+        data = bytes(data)
+        self.pending.acquire()
+        self.size += len(data)
+        self.loop.call_soon_threadsafe(self._handover, data)
+    def _handover(self, data):
+        try:
+            self.onchunk(data)
+        finally:
+            self.pending.release()
+
+class _GeoInterface(object):
+    """
+    Holds a plain copy of the geojson dictionary of a geojson object.
+    For internal use only.
+    """
+    def __init__(self, geojson):
+        self.__geo_interface__ = geojson
+
+class _ShapeRecorder(Image):
+    """
+    Looks like the image it was created from, but instead of drawing
+    the shapes it keeps them in pixel coordinates in the shapes list,
+    as (drawmethodname, geometry, options) tuples. Shapes drawn with a
+    blend mode are kept as ("_blended", (blendmode, shapes), {}) tuples.
+    For internal use only.
+    """
+    def __init__(self, img):
+        self.width = img.width
+        self.height = img.height
+        self.crs = img.crs
+        self.coordmode = img.coordmode
+        self.shapes = []
+    def _drawline(self, x1, y1, x2, y2, **options):
+        self.shapes.append(("_drawline", (x1, y1, x2, y2), options))
+    def _drawpolygon(self, coords, holes=[], **options):
+        self.shapes.append(("_drawpolygon", (list(coords), [list(hole) for hole in holes]), options))
+    def _drawmultiline(self, coords, **options):
+        self.shapes.append(("_drawmultiline", list(coords), options))
+    def _drawcircle(self, x, y, fillsize, **options):
+        self.shapes.append(("_drawcircle", (x, y, fillsize), options))
+    @contextlib.contextmanager
+    def _blendlayer(self, blendmode):
+        #shapes drawn with a blend mode are kept together as one "_blended" shape
+        if blendmode == "normal":
+            yield
+            return
+        shapes = self.shapes
+        self.shapes = []
+        try:
+            yield
+        finally:
+            shapes.append(("_blended", (blendmode, self.shapes), dict()))
+            self.shapes = shapes
+
+class _PolygonRecorder(_ShapeRecorder):
+    """
+    Like _ShapeRecorder, but lets each shape be turned into the polygons and
+    thin lines that it is drawn as, and keeps those instead, as filled
+    "_drawpolygon" shapes without outline and thin "_drawline" shapes.
+    For internal use only.
+    """
+    _drawline = Image._drawline
+    _drawpolygon = Image._drawpolygon
+    _drawmultiline = Image._drawmultiline
+    _drawcircle = Image._drawcircle
+    def _fillpolygon(self, rings, fillcolor, fillrule="evenodd"):
+        rings = [list(ring) for ring in rings]
+        self.shapes.append(("_drawpolygon", (rings[0], rings[1:]), dict(fillcolor=fillcolor, outlinecolor=None, fillrule=fillrule)))
+    def _drawsimpleline(self, x1, y1, x2, y2, col, thick=1):
+        self.shapes.append(("_drawline", (x1, y1, x2, y2), dict(fillcolor=col, fillsize=thick)))
+
+def _shapebbox(shape):
+    """
+    The pixel bbox of a recorded shape, including its line thickness,
+    outline and antialiasing.
+    For internal use only.
+    """
+    methodname,geometry,options = shape
+    if methodname == "_drawcircle":
+        x,y,fillsize = geometry
+        margin = fillsize + options.get("outlinewidth",1) + 2
+        return x-margin, y-margin, x+margin, y+margin
+    if methodname == "_drawpolygon":
+        coords = geometry[0]
+        margin = 2
+        if options.get("outlinecolor"):
+            margin += 2*options.get("outlinewidth",1)
+    elif methodname == "_drawline":
+        x1,y1,x2,y2 = geometry
+        coords = [(x1,y1),(x2,y2)]
+        margin = 2 + options.get("fillsize",1)
+    else:
+        coords = geometry
+        margin = 2 + 2*options.get("fillsize",1)
+    xs,ys = zip(*coords)
+    return min(xs)-margin, min(ys)-margin, max(xs)+margin, max(ys)+margin
+
+def _drawshape(img, shape, x=0, y=0, scale=1):
+    """
+    Draws a recorded shape onto an image, with x and y being
+    where the image starts in the pixel space of the shape,
+    and scale how many image pixels there are to each pixel
+    of the shape, eg for supersampling.
+    New coordinate lists are made since drawing may change them.
+    For internal use only.
+    """
+    methodname,geometry,options = shape
+    if methodname == "_blended":
+        blendmode,shapes = geometry
+        with img._blendlayer(blendmode):
+            for eachshape in shapes:
+                _drawshape(img, eachshape, x, y, scale)
+        return
+    if scale == 1:
+        def point(px, py):
+            return px-x, py-y
+    else:
+        #pixel centers of the shape become block centers of the image
+        offset = (scale-1)/2.0
+        def point(px, py):
+            return (px-x)*scale+offset, (py-y)*scale+offset
+        options = dict(options)
+        for sizename in ("fillsize","outlinewidth"):
+            if sizename in options:
+                options[sizename] *= scale
+    with img._blendlayer("normal"):
+        if methodname == "_drawcircle":
+            cx,cy,fillsize = geometry
+            cx,cy = point(cx, cy)
+            img._drawcircle(cx, cy, fillsize*scale, **options)
+        elif methodname == "_drawline":
+            x1,y1,x2,y2 = geometry
+            (x1,y1),(x2,y2) = point(x1, y1),point(x2, y2)
+            img._drawline(x1, y1, x2, y2, **options)
+        elif methodname == "_drawpolygon":
+            coords,holes = geometry
+            coords = [point(px, py) for px,py in coords]
+            holes = [[point(px, py) for px,py in hole] for hole in holes]
+            img._drawpolygon(coords, holes=holes, **options)
+        else:
+            coords = [point(px, py) for px,py in geometry]
+            img._drawmultiline(coords, **options)
+
+def _drawtile(task):
+    """
+    Draws the recorded shapes onto the pixels of one tile, in a worker process.
+    The shapes are moved so the tile, given with a border, starts at 0,0,
+    and the tile is returned without the border.
+    For internal use only.
+    """
+    padx, pady, x, y, tilesize, mode, supersample, linearblend, rows, shapes = task
+    tile = Image(len(rows[0]), len(rows), mode=mode, supersample=supersample, linearblend=linearblend)
+    tile.imagegrid = rows
+    for shape in shapes:
+        _drawshape(tile, shape, x, y)
+    rows = [row[padx:padx+tilesize] for row in tile.imagegrid[pady:pady+tilesize]]
+    return x+padx, y+pady, rows
+
+def _alphatables():
+    """
+    The integer tables for premultiplied alpha, made the first time they are needed.
+    multiply[a][c] is c*a/255, and divide[a][c] is c*255/a, both rounded.
+    For internal use only.
+    """
+    global _ALPHATABLES
+    if _ALPHATABLES is None:
+        multiply = [array.array("B", [(c*a + 127)//255 for c in xrange(256)]) for a in xrange(256)]
+        divide = [array.array("B", [0]*256)]
+        divide.extend(array.array("B", [min((c*255 + a//2)//a, 255) for c in xrange(256)]) for a in xrange(1,256))
+        _ALPHATABLES = multiply,divide
+    return _ALPHATABLES
+
+def _premultiply(color):
+    """
+    Turns an RGB or normal RGBA color into a premultiplied RGBA color.
+    For internal use only.
+    """
+    if len(color) == 3 or color[3] >= 255:
+        return (int(color[0]),int(color[1]),int(color[2]),255)
+    a = max(int(color[3] + 0.5), 0)
+    multiply = _alphatables()[0][a]
+    return (multiply[int(color[0])],multiply[int(color[1])],multiply[int(color[2])],a)
+
+def _unpremultiply(color):
+    """
+    Turns a premultiplied RGBA color back into a normal RGBA color.
+    For internal use only.
+    """
+    a = color[3]
+    if a == 255:
+        return color
+    divide = _alphatables()[1][a]
+    return (divide[color[0]],divide[color[1]],divide[color[2]],a)
+
+def _linetemplate(width, style):
+    """
+    The outline of a line cap or round join for a line width, made once and then
+    kept. Cap templates are (along,across) offsets from the end of a line going
+    along +x, from the right side around the end to the left side, and are turned
+    and moved to each line end. The "roundjoin" template is a whole circle of
+    (x,y) offsets, from which the arc of each join is taken.
+    The number of points keeps the curves within a tenth of a pixel.
+    For internal use only.
+    """
+    key = (width, style)
+    template = _LINETEMPLATES.get(key)
+    if template is None:
+        buff = width/2.0
+        if style in ("round","roundjoin"):
+            step = 2*math.acos(1 - 0.1/buff) if buff > 0.1 else math.pi/2
+        if style == "butt":
+            template = [(0,-buff),(0,buff)]
+        elif style == "projecting":
+            template = [(0,-buff),(buff,-buff),(buff,buff),(0,buff)]
+        elif style == "round":
+            count = max(int(math.ceil(math.pi/step)), 2)
+            template = [(buff*math.sin(math.pi*index/count), -buff*math.cos(math.pi*index/count)) for index in xrange(count+1)]
+        elif style == "roundjoin":
+            count = max(int(math.ceil(2*math.pi/step)), 8)
+            template = [(buff*math.cos(2*math.pi*index/count), buff*math.sin(2*math.pi*index/count)) for index in xrange(count)]
+        else:
+            raise ValueError("unknown line style %s" % style)
+        if len(_LINETEMPLATES) >= 256:
+            _LINETEMPLATES.clear()
+        _LINETEMPLATES[key] = template
+    return template
+
+def _roundjoin(width, x, y, start, end):
+    """
+    The points of the round join template around x,y that lie on the short way
+    from the angle of the start point to the angle of the end point.
+    For internal use only.
+    """
+    template = _linetemplate(width, "roundjoin")
+    step = 2*math.pi/len(template)
+    startangle = math.atan2(start[1]-y, start[0]-x)
+    turn = (math.atan2(end[1]-y, end[0]-x) - startangle) % (2*math.pi)
+    if turn > math.pi:
+        turn -= 2*math.pi
+    if turn >= 0:
+        indexes = range(int(math.floor(startangle/step))+1, int(math.ceil((startangle+turn)/step)))
+    else:
+        indexes = range(int(math.ceil(startangle/step))-1, int(math.floor((startangle+turn)/step)), -1)
+    return [(x+template[index % len(template)][0], y+template[index % len(template)][1]) for index in indexes]
+
+def _subpixelweights():
+    """
+    The table of how much of a point falls on each of the four pixels it covers,
+    made the first time it is needed. Indexed by the y and x fractions of the point
+    in sixteenths as y*16+x, each entry has the integer weights of the top left,
+    top right, bottom left and bottom right pixels, adding up to 255.
+    For internal use only.
+    """
+    global _SUBPIXELWEIGHTS
+    if _SUBPIXELWEIGHTS is None:
+        table = []
+        for fy in xrange(16):
+            for fx in xrange(16):
+                weights = [((16-fx)*(16-fy)*255 + 128) // 256, (fx*(16-fy)*255 + 128) // 256,
+                           ((16-fx)*fy*255 + 128) // 256, (fx*fy*255 + 128) // 256]
+                #put the rounding error on the largest weight
+                weights[weights.index(max(weights))] += 255 - sum(weights)
+                table.append(tuple(weights))
+        _SUBPIXELWEIGHTS = table
+    return _SUBPIXELWEIGHTS
+
+def _gammatables():
+    """
+    The tables for blending in linear light, made the first time they are needed.
+    tolinear has the 12 bit linear light value of each 8 bit sRGB value, and fromlinear
+    the 8 bit sRGB value of each 12 bit linear value, which keeps the dark colors exact.
+    For internal use only.
+    """
+    global _GAMMATABLES
+    if _GAMMATABLES is None:
+        def linear(c):
+            return c/12.92 if c <= 0.04045 else ((c+0.055)/1.055)**2.4
+        def srgb(c):
+            return c*12.92 if c <= 0.0031308 else 1.055*c**(1/2.4) - 0.055
+        tolinear = array.array("H", [int(round(linear(c/255.0)*4095)) for c in xrange(256)])
+        fromlinear = array.array("B", [int(round(srgb(c/4095.0)*255)) for c in xrange(4096)])
+        _GAMMATABLES = tolinear,fromlinear
+    return _GAMMATABLES
+
+def _linearpremultiplied(color):
+    """
+    Turns a premultiplied RGBA color into linear light values premultiplied by alpha,
+    so that colors can be summed, eg for averaging.
+    For internal use only.
+    """
+    a = color[3]
+    if not a:
+        return (0,0,0,0)
+    tolinear = _gammatables()[0]
+    divide = _alphatables()[1][a]
+    return (tolinear[divide[color[0]]]*a, tolinear[divide[color[1]]]*a, tolinear[divide[color[2]]]*a, a)
+
+def _srgbpremultiplied(color):
+    """
+    Turns linear light values premultiplied by alpha, eg averaged by _linearpremultiplied,
+    back into a premultiplied RGBA color.
+    For internal use only.
+    """
+    a = color[3]
+    if not a:
+        return (0,0,0,0)
+    fromlinear = _gammatables()[1]
+    multiply = _alphatables()[0][a]
+    return (multiply[fromlinear[min((color[0] + a//2)//a, 4095)]], multiply[fromlinear[min((color[1] + a//2)//a, 4095)]],
+            multiply[fromlinear[min((color[2] + a//2)//a, 4095)]], a)
+
+#BLEND MODE ROW KERNELS
+#each blends a row of premultiplied RGBA layer pixels onto a row of image pixels
+#and returns the new image row, the RGB kernels assume opaque image pixels
+
+def _overrgb(destrow, srcrow):
+    multiply = _alphatables()[0]
+    out = []
+    append = out.append
+    for d,s in itertools.izip(destrow, srcrow):
+        a = s[3]
+        if a == 255:
+            append(s[:3])
+        elif not a:
+            append(d)
+        else:
+            keep = multiply[255-a]
+            append((s[0] + keep[d[0]], s[1] + keep[d[1]], s[2] + keep[d[2]]))
+    return out
+
+def _overrgba(destrow, srcrow):
+    multiply = _alphatables()[0]
+    out = []
+    append = out.append
+    for d,s in itertools.izip(destrow, srcrow):
+        a = s[3]
+        if a == 255:
+            append(s)
+        elif not a:
+            append(d)
+        else:
+            keep = multiply[255-a]
+            append((s[0] + keep[d[0]], s[1] + keep[d[1]], s[2] + keep[d[2]], a + keep[d[3]]))
+    return out
+
+def _multiplyrgb(destrow, srcrow):
+    multiply = _alphatables()[0]
+    clamp = _CLAMP
+    out = []
+    append = out.append
+    for d,s in itertools.izip(destrow, srcrow):
+        if not s[3]:
+            append(d)
+            continue
+        keep = multiply[255-s[3]]
+        append((clamp[multiply[s[0]][d[0]] + keep[d[0]]], clamp[multiply[s[1]][d[1]] + keep[d[1]]],
+                clamp[multiply[s[2]][d[2]] + keep[d[2]]]))
+    return out
+
+def _multiplyrgba(destrow, srcrow):
+    multiply = _alphatables()[0]
+    clamp = _CLAMP
+    out = []
+    append = out.append
+    for d,s in itertools.izip(destrow, srcrow):
+        if not s[3]:
+            append(d)
+            continue
+        keep,show = multiply[255-s[3]],multiply[255-d[3]]
+        append((clamp[multiply[s[0]][d[0]] + show[s[0]] + keep[d[0]]], clamp[multiply[s[1]][d[1]] + show[s[1]] + keep[d[1]]],
+                clamp[multiply[s[2]][d[2]] + show[s[2]] + keep[d[2]]], s[3] + keep[d[3]]))
+    return out
+
+def _screenrgb(destrow, srcrow):
+    multiply = _alphatables()[0]
+    out = []
+    append = out.append
+    for d,s in itertools.izip(destrow, srcrow):
+        if not s[3]:
+            append(d)
+            continue
+        append((s[0] + d[0] - multiply[s[0]][d[0]], s[1] + d[1] - multiply[s[1]][d[1]],
+                s[2] + d[2] - multiply[s[2]][d[2]]))
+    return out
+
+def _screenrgba(destrow, srcrow):
+    multiply = _alphatables()[0]
+    out = []
+    append = out.append
+    for d,s in itertools.izip(destrow, srcrow):
+        if not s[3]:
+            append(d)
+            continue
+        append((s[0] + d[0] - multiply[s[0]][d[0]], s[1] + d[1] - multiply[s[1]][d[1]],
+                s[2] + d[2] - multiply[s[2]][d[2]], s[3] + multiply[255-s[3]][d[3]]))
+    return out
+
+def _minmaxrgb(choose):
+    def kernel(destrow, srcrow):
+        multiply = _alphatables()[0]
+        clamp = _CLAMP
+        out = []
+        append = out.append
+        for d,s in itertools.izip(destrow, srcrow):
+            if not s[3]:
+                append(d)
+                continue
+            keep,cover = multiply[255-s[3]],multiply[s[3]]
+            append((clamp[choose(s[0], cover[d[0]]) + keep[d[0]]], clamp[choose(s[1], cover[d[1]]) + keep[d[1]]],
+                    clamp[choose(s[2], cover[d[2]]) + keep[d[2]]]))
+        return out
+    return kernel
+
+def _minmaxrgba(choose):
+    def kernel(destrow, srcrow):
+        multiply = _alphatables()[0]
+        clamp = _CLAMP
+        out = []
+        append = out.append
+        for d,s in itertools.izip(destrow, srcrow):
+            if not s[3]:
+                append(d)
+                continue
+            keep,show,cover,behind = multiply[255-s[3]],multiply[255-d[3]],multiply[s[3]],multiply[d[3]]
+            append((clamp[choose(behind[s[0]], cover[d[0]]) + show[s[0]] + keep[d[0]]],
+                    clamp[choose(behind[s[1]], cover[d[1]]) + show[s[1]] + keep[d[1]]],
+                    clamp[choose(behind[s[2]], cover[d[2]]) + show[s[2]] + keep[d[2]]],
+                    s[3] + keep[d[3]]))
+        return out
+    return kernel
+
+def _porterduff(sourcefactor, destfactor):
+    """
+    Makes a row kernel for a Porter-Duff operator, where the layer colors are weighted by
+    sourcefactor of the image alpha and the image colors by destfactor of the layer alpha,
+    each factor being "one", "zero", "alpha" or "inverse" (255 minus alpha).
+    For internal use only.
+    """
+    factors = dict(one=[255]*256, zero=[0]*256, alpha=range(256), inverse=range(255,-1,-1))
+    sourcefactor,destfactor = factors[sourcefactor],factors[destfactor]
+    def kernel(destrow, srcrow):
+        multiply = _alphatables()[0]
+        clamp = _CLAMP
+        out = []
+        append = out.append
+        for d,s in itertools.izip(destrow, srcrow):
+            fs,fd = multiply[sourcefactor[d[3]]],multiply[destfactor[s[3]]]
+            append((clamp[fs[s[0]] + fd[d[0]]], clamp[fs[s[1]] + fd[d[1]]],
+                    clamp[fs[s[2]] + fd[d[2]]], clamp[fs[s[3]] + fd[d[3]]]))
+        return out
+    return kernel
+
+#name: (kernel for RGB images, kernel for RGBA images, whether it changes the whole image)
+_BLENDMODES = {"normal": (_overrgb, _overrgba, False),
+               "multiply": (_multiplyrgb, _multiplyrgba, False),
+               "screen": (_screenrgb, _screenrgba, False),
+               "darken": (_minmaxrgb(min), _minmaxrgba(min), False),
+               "lighten": (_minmaxrgb(max), _minmaxrgba(max), False),
+               "destination-over": (None, _porterduff("inverse","one"), False),
+               "source-atop": (None, _porterduff("alpha","inverse"), False),
+               "destination-out": (None, _porterduff("zero","inverse"), False),
+               "xor": (None, _porterduff("inverse","inverse"), False),
+               "source-in": (None, _porterduff("alpha","zero"), True),
+               "source-out": (None, _porterduff("inverse","zero"), True),
+               "destination-in": (None, _porterduff("zero","alpha"), True),
+               "destination-atop": (None, _porterduff("inverse","alpha"), True),
+               "copy": (None, _porterduff("one","zero"), True),
+               "clear": (None, _porterduff("zero","zero"), True)}
+
+def _linearkernel(blend, sourcefactor, destfactor, rgba):
+    """
+    Makes a row kernel that blends in linear light, for any blend mode. The straight
+    colors are turned into 12 bit linear values with the gamma tables, mixed by the
+    blend function if any (for the parts where both are visible), weighted by the
+    Porter-Duff factors as in _porterduff, and turned back into sRGB.
+    For internal use only.
+    """
+    factors = dict(one=[255]*256, zero=[0]*256, alpha=range(256), inverse=range(255,-1,-1))
+    over = blend is None and sourcefactor == "one" and destfactor == "inverse"
+    sourcefactor,destfactor = factors[sourcefactor],factors[destfactor]
+    def kernel(destrow, srcrow):
+        tolinear,fromlinear = _gammatables()
+        multiply,divide = _alphatables()
+        out = []
+        append = out.append
+        for d,s in itertools.izip(destrow, srcrow):
+            sa = s[3]
+            if over and sa == 255:
+                append(s if rgba else s[:3])
+                continue
+            da = d[3] if rgba else 255
+            if not sa and destfactor[0] == 255:
+                #nothing drawn and the image is kept as it is
+                append(d)
+                continue
+            wsource = sourcefactor[da]*sa/65025.0
+            wdest = destfactor[sa]*da/65025.0
+            outa = wsource + wdest
+            if outa <= 0:
+                append((0,0,0,0) if rgba else (0,0,0))
+                continue
+            sourcecolors = [tolinear[c] for c in itertools.imap(divide[sa].__getitem__, s[:3])]
+            destcolors = [tolinear[c] for c in itertools.imap(divide[da].__getitem__, d[:3])]
+            if blend:
+                visible = da/255.0
+                sourcecolors = [sc*(1-visible) + blend(dc, sc)*visible for sc,dc in itertools.izip(sourcecolors, destcolors)]
+            colors = [fromlinear[min(int((sc*wsource + dc*wdest)/outa + 0.5), 4095)] for sc,dc in itertools.izip(sourcecolors, destcolors)]
+            if rgba:
+                outa = int(outa*255 + 0.5)
+                result = multiply[outa]
+                append((result[colors[0]], result[colors[1]], result[colors[2]], outa))
+            else:
+                append(tuple(colors))
+        return out
+    return kernel
+
+#name: (blend function of two linear values, source factor, destination factor), see _linearkernel
+_LINEARBLENDS = {"normal": (None, "one", "inverse"),
+                 "multiply": (lambda dest,source: dest*source/4095.0, "one", "inverse"),
+                 "screen": (lambda dest,source: dest + source - dest*source/4095.0, "one", "inverse"),
+                 "darken": (min, "one", "inverse"),
+                 "lighten": (max, "one", "inverse"),
+                 "destination-over": (None, "inverse", "one"),
+                 "source-atop": (None, "alpha", "inverse"),
+                 "destination-out": (None, "zero", "inverse"),
+                 "xor": (None, "inverse", "inverse"),
+                 "source-in": (None, "alpha", "zero"),
+                 "source-out": (None, "inverse", "zero"),
+                 "destination-in": (None, "zero", "alpha"),
+                 "destination-atop": (None, "inverse", "alpha"),
+                 "copy": (None, "one", "zero"),
+                 "clear": (None, "zero", "zero")}
+
+def _blendkernel(blendmode, mode, linear=False):
+    """
+    Get the row kernel of a blend mode for an image of the given mode, blending in
+    linear light or not, and whether it changes the whole image. Raises ValueError
+    for unknown blend modes and for those that need an RGBA image.
+    For internal use only.
+    """
+    if blendmode not in _BLENDMODES:
+        raise ValueError("unknown blend mode %s" % blendmode)
+    rgbkernel,rgbakernel,unbounded = _BLENDMODES[blendmode]
+    kernel = rgbakernel if mode == "RGBA" else rgbkernel
+    if kernel is None:
+        raise ValueError("the %s blend mode needs an RGBA image" % blendmode)
+    if linear:
+        key = (blendmode, mode)
+        if key not in _LINEARKERNELS:
+            _LINEARKERNELS[key] = _linearkernel(*_LINEARBLENDS[blendmode] + (mode == "RGBA",))
+        kernel = _LINEARKERNELS[key]
+    return kernel,unbounded
+
+_LINEARKERNELS = dict() #the linear light kernels made so far by _blendkernel
 
 if __name__ == "__main__":
     import pydraw.tester as tester
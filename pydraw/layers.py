@@ -0,0 +1,180 @@
+# Pydraw submodule
+# Images made of several layers that are flattened when needed
+
+import itertools,copy
+from core import Image, _BLENDMODES, _alphatables, _blendkernel
+
+
+class LayeredImage(object):
+    def __init__(self, width, height, background=None, mode="RGB", crs=None, linearblend=False):
+        """
+        An image made of a stack of layers, each a transparent RGBA image that
+        is drawn on as usual. Each layer has its own opacity, visibility, order
+        and blend mode, which can be changed at any time without drawing it again.
+
+        The layers are flattened into one image only when needed, eg when
+        viewing or saving. Only the rows that have been drawn on or that are
+        touched by changed layers since the last time are flattened again,
+        so eg hiding a layer does not redo the other layers.
+
+        | **option** | **description**
+        | --- | ---
+        | width/height | the size of the image and its layers in pixels, integers
+        | *background | the color tuple that the layers are flattened onto, default as for Image
+        | *mode | the mode of the flattened image, "RGB" (default) or "RGBA", see Image
+        | *crs | a coordinate system instance for the flattened image, of which each layer gets its own copy, see Image
+        | *linearblend | True to blend the layers and draw on them in linear light, see Image
+
+        """
+        self.width = width
+        self.height = height
+        self.crs = crs
+        self._flat = Image(width, height, background=background, mode=mode, crs=crs, linearblend=linearblend)
+        self._background = self._flat.imagegrid[0][0] if height and width else None
+        self._layers = []
+        self._changed = bytearray(height)
+
+    def addlayer(self, name, index=None, opacity=1.0, visible=True, blendmode="normal"):
+        """
+        Adds a new empty layer and returns its image to draw on.
+
+        | **option** | **description**
+        | --- | ---
+        | name | a unique name for the layer
+        | *index | where to put the layer in the stack, 0 being the bottom, default is on top
+        | *opacity | how opaque the layer is, from 0.0 (invisible) to 1.0 (default)
+        | *visible | whether the layer is shown, default is True
+        | *blendmode | how the layer is combined with the layers below, see the Image class
+
+        """
+        if name in self.layernames():
+            raise ValueError("there is already a layer named %s" % name)
+        crs = copy.copy(self.crs) if self.crs else None
+        layer = _Layer(name, Image(self.width, self.height, mode="RGBA", crs=crs, linearblend=self._flat.linearblend))
+        self._checkblendmode(blendmode)
+        layer.opacity,layer.visible,layer.blendmode = opacity,visible,blendmode
+        if index is None:
+            index = len(self._layers)
+        self._layers.insert(index, layer)
+        self._markrows(layer)
+        return layer.image
+
+    def getlayer(self, name):
+        """
+        Get the image of a layer to draw on.
+        """
+        return self._getlayer(name).image
+
+    def setlayer(self, name, opacity=None, visible=None, blendmode=None, index=None):
+        """
+        Changes the opacity, visibility, blend mode or stack position of a layer,
+        see addlayer. Options that are not given are left as they are.
+        """
+        layer = self._getlayer(name)
+        self._markrows(layer)
+        if opacity is not None:
+            layer.opacity = opacity
+        if visible is not None:
+            layer.visible = visible
+        if blendmode is not None:
+            self._checkblendmode(blendmode)
+            layer.blendmode = blendmode
+        if index is not None:
+            self._layers.remove(layer)
+            self._layers.insert(index, layer)
+        self._markrows(layer)
+
+    def removelayer(self, name):
+        """
+        Removes a layer.
+        """
+        layer = self._getlayer(name)
+        self._markrows(layer)
+        self._layers.remove(layer)
+
+    def layernames(self):
+        """
+        Get the names of the layers from the bottom to the top.
+        """
+        return [layer.name for layer in self._layers]
+
+    def flatten(self):
+        """
+        Get the flattened image of all the visible layers, with only the rows that
+        changed since the last time being flattened again. The same image instance
+        is returned every time, so don't draw on it directly.
+        """
+        changed = self._changed
+        for layer in self._layers:
+            for starty,stopy in layer.image.popdirtyrows("flatten"):
+                layer.used[starty:stopy] = b"\x01" * (stopy - starty)
+                changed[starty:stopy] = b"\x01" * (stopy - starty)
+        multiply = _alphatables()[0]
+        blank = [self._background] * self.width
+        y = changed.find(b"\x01")
+        while y != -1:
+            row = blank
+            for layer in self._layers:
+                kernel,unbounded = _blendkernel(layer.blendmode, self._flat.mode, self._flat.linearblend)
+                if not layer.visible or not (layer.used[y] or unbounded):
+                    continue
+                layerrow = layer.image.imagegrid[y]
+                alpha = max(min(int(round(255*layer.opacity)),255),0)
+                if alpha < 255:
+                    scale = multiply[alpha]
+                    layerrow = [(scale[c[0]],scale[c[1]],scale[c[2]],scale[c[3]]) for c in layerrow]
+                row = kernel(row, layerrow)
+            self._flat.imagegrid[y] = list(row)
+            self._flat._dirty[y] = 1
+            y = changed.find(b"\x01", y+1)
+        self._changed = bytearray(self.height)
+        return self._flat
+
+    def view(self):
+        """
+        Pops up a Tkinter window in which to view the flattened image.
+        """
+        self.flatten().view()
+
+    def updateview(self):
+        """
+        Updates the Tkinter window to include recent changes to the layers,
+        only sending the rows that changed.
+        """
+        self.flatten().updateview()
+
+    def save(self, savepath):
+        """
+        Saves the flattened image to the given filepath, see Image.save.
+        """
+        self.flatten().save(savepath)
+
+    #INTERNAL USE ONLY
+    def _getlayer(self, name):
+        for layer in self._layers:
+            if layer.name == name:
+                return layer
+        raise KeyError("there is no layer named %s" % name)
+    def _checkblendmode(self, blendmode):
+        _blendkernel(blendmode, self._flat.mode)
+    def _markrows(self, layer):
+        #the rows that must be flattened again when the layer changes
+        if _BLENDMODES[layer.blendmode][2]:
+            self._changed = bytearray(b"\x01" * self.height)
+        else:
+            self._changed = bytearray(itertools.imap(max, self._changed, layer.used))
+
+class _Layer(object):
+    """
+    One layer of a LayeredImage, with the rows ever drawn on kept in used.
+    For internal use only.
+    """
+    def __init__(self, name, image):
+        self.name = name
+        self.image = image
+        self.opacity = 1.0
+        self.visible = True
+        self.blendmode = "normal"
+        self.used = bytearray(image.height)
+        #start keeping the changes for flatten apart from those for eg the view
+        image.popdirtyrows("flatten")
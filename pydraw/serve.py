@@ -0,0 +1,241 @@
+# Pydraw submodule
+# A small local render server, run with "python -m pydraw.serve"
+
+"""
+Runs a render server on localhost that draws images from JSON draw jobs
+and returns them as PNG file bytes. Jobs are drawn by a pool of worker
+processes that is started once, so each job does not pay for starting
+Python, importing PyDraw or warming up.
+
+A job is POSTed as a JSON object to any path, and may have these keys:
+
+| **key** | **description**
+| --- | ---
+| width/height | the size of the image in pixels
+| *bbox | the coordinate bbox of the image as [xleft,ytop,xright,ybottom], to draw in coordinates instead of pixels
+| *background | an RGB color list for the image background
+| drawcalls | list of [methodname, options] pairs, where methodname is one of the draw methods of the Image class except drawtiled, and options an object with its arguments. The geojobj option of drawgeojson is given as a GeoJSON geometry object.
+
+Jobs that target the same canvas, ie the same size, bbox and background,
+and that wait while all the workers are busy, are batched and sent to a
+worker together, which makes the blank canvas only once for all of them.
+Identical jobs that arrive while the first of them is still being drawn
+are not drawn again but get the same result.
+
+Options when starting the server:
+
+- --port: the port to listen on, default is 8080
+- --processes: how many worker processes to draw with, default is the number of CPUs
+"""
+
+import sys,json,threading,argparse,multiprocessing
+import pydraw
+from pydraw.tilecache import _encodepng
+
+#PYTHON VERSION CHECKING
+PYTHON3 = int(sys.version[0]) == 3
+if PYTHON3:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+else:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+
+class RenderServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+    def __init__(self, port=8080, processes=None):
+        """
+        The render server, listening on localhost at the given port.
+        Call serve_forever to start answering requests.
+        """
+        HTTPServer.__init__(self, ("127.0.0.1", port), _RenderHandler)
+        processes = processes or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(processes, initializer=_warmup)
+        self._inflight = dict()
+        self._batches = dict()
+        self._workers = threading.Semaphore(processes)
+        self._lock = threading.Lock()
+
+    def render(self, jobtext):
+        """
+        Draws a job given as a JSON string in the worker pool and returns the PNG file bytes.
+        A job identical to one still being drawn waits for and shares its result.
+        """
+        job = json.loads(jobtext)
+        key = json.dumps(job, sort_keys=True)
+        with self._lock:
+            shared = self._inflight.get(key)
+            if shared is None:
+                shared = self._inflight[key] = _SharedResult()
+                owner = True
+            else:
+                owner = False
+        if owner:
+            try:
+                shared.data = self._renderbatched(job)
+            except Exception as err:
+                shared.error = err
+            with self._lock:
+                del self._inflight[key]
+            shared.done.set()
+        else:
+            shared.done.wait()
+        if shared.error:
+            raise shared.error
+        return shared.data
+
+    def _renderbatched(self, job):
+        """
+        Adds a job to the batch of jobs waiting for a worker to draw on the same
+        canvas, and returns the PNG file bytes once the batch has been drawn.
+        The first job of a batch waits for a free worker and then sends the whole batch.
+        For internal use only.
+        """
+        key = json.dumps([job.get("width"), job.get("height"), job.get("bbox"), job.get("background")])
+        with self._lock:
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = self._batches[key] = _SharedResult()
+                sender = True
+            else:
+                sender = False
+            index = len(batch.jobs)
+            batch.jobs.append(job)
+        if sender:
+            self._workers.acquire()
+            try:
+                with self._lock:
+                    #no more jobs may join the batch once it is sent
+                    del self._batches[key]
+                batch.data = self.pool.apply_async(_renderbatch, (batch.jobs,)).get()
+            except Exception as err:
+                batch.error = err
+            finally:
+                self._workers.release()
+            batch.done.set()
+        else:
+            batch.done.wait()
+        if batch.error:
+            raise batch.error
+        result = batch.data[index]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.pool.close()
+        self.pool.join()
+
+class _RenderHandler(BaseHTTPRequestHandler):
+    """
+    Answers each POSTed JSON job with the drawn PNG image.
+    For internal use only.
+    """
+    def do_POST(self):
+        try:
+            jobtext = self.rfile.read(int(self.headers["Content-Length"]))
+            data = self.server.render(jobtext.decode("utf-8"))
+        except Exception as err:
+            message = ("%s: %s" % (type(err).__name__, err)).encode("utf-8")
+            self.send_response(400)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(message)))
+            self.end_headers()
+            self.wfile.write(message)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    def log_message(self, *args):
+        pass
+
+class _SharedResult(object):
+    """
+    The result of a job, shared by all requests for that same job,
+    or the results of a batch of jobs, shared by the requests in it.
+    For internal use only.
+    """
+    def __init__(self):
+        self.jobs = []
+        self.done = threading.Event()
+        self.data = None
+        self.error = None
+
+class _GeoJSON(object):
+    """
+    Gives a plain GeoJSON dictionary the __geo_interface__ of a geojson object.
+    For internal use only.
+    """
+    def __init__(self, geojson):
+        self.__geo_interface__ = geojson
+
+def _warmup():
+    """
+    Draws and encodes a tiny image when a worker process starts,
+    so that the first real job does not pay for it.
+    For internal use only.
+    """
+    img = pydraw.Image(8, 8)
+    img.drawpolygon([(1,1),(6,2),(4,6)], fillcolor=(0,0,0), outlinecolor=(0,0,0))
+    _encodepng(img)
+
+def _renderbatch(jobs):
+    """
+    Draws a batch of jobs on the same canvas in a worker process, and returns
+    the PNG file bytes of each, or the error for those that failed.
+    For internal use only.
+    """
+    background = jobs[0].get("background")
+    if background:
+        background = tuple(background)
+    blank = None
+    results = []
+    for job in jobs:
+        try:
+            if blank is None:
+                blank = pydraw.Image(job["width"], job["height"], background=background).imagegrid
+            results.append(_renderjob(job, [list(row) for row in blank]))
+        except Exception as err:
+            results.append(err)
+    return results
+
+def _renderjob(job, imagegrid):
+    """
+    Draws one job onto a copy of the blank canvas and returns the PNG file bytes.
+    For internal use only.
+    """
+    crs = None
+    if job.get("bbox"):
+        crs = pydraw.CoordinateSystem(job["bbox"])
+    img = pydraw.Image(data=imagegrid, crs=crs)
+    for methodname,options in job["drawcalls"]:
+        if not methodname.startswith("draw") or not hasattr(img, methodname):
+            raise ValueError("%s is not a draw method" % methodname)
+        if methodname == "drawtiled":
+            #the workers are daemonic processes, which may not start a pool of their own
+            raise ValueError("drawtiled cannot be used in render server jobs")
+        if methodname == "drawgeojson":
+            options["geojobj"] = _GeoJSON(options["geojobj"])
+        getattr(img, methodname)(**dict((str(key),value) for key,value in options.items()))
+    return _encodepng(img)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a PyDraw render server on localhost.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+    server = RenderServer(port=args.port, processes=args.processes)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
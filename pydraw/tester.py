@@ -56,3 +56,312 @@ def testall():
 ##    holes = [[(-100,-50),(-100,50),(100,10),(100,-50)]]
 ##    img.drawpolygon(poly, holes=holes)
 ##    img.view()
+
+
+def testfillcoverage():
+    """
+    Checks the antialiased polygon fill against the exact area that the polygon
+    covers of each pixel, also for polygons reaching off the canvas and with holes.
+    Raises an AssertionError at the first pixel that is off by more than rounding.
+    """
+
+    import random
+    import pydraw
+
+    def clip(ring, inside, intersect):
+        #one side of a Sutherland-Hodgman clip
+        out = []
+        for i in range(len(ring)):
+            cur,prev = ring[i],ring[i-1]
+            if inside(cur):
+                if not inside(prev):
+                    out.append(intersect(prev, cur))
+                out.append(cur)
+            elif inside(prev):
+                out.append(intersect(prev, cur))
+        return out
+
+    def pixelarea(ring, px, py):
+        #pixel centers are at whole numbers, so each pixel spans half a pixel around it
+        x1,y1,x2,y2 = px-0.5,py-0.5,px+0.5,py+0.5
+        def atx(x):
+            return lambda a,b: (x, a[1] + (b[1]-a[1]) * (x-a[0]) / float(b[0]-a[0]))
+        def aty(y):
+            return lambda a,b: (a[0] + (b[0]-a[0]) * (y-a[1]) / float(b[1]-a[1]), y)
+        for inside,intersect in ((lambda p: p[0] >= x1, atx(x1)),
+                                 (lambda p: p[0] <= x2, atx(x2)),
+                                 (lambda p: p[1] >= y1, aty(y1)),
+                                 (lambda p: p[1] <= y2, aty(y2))):
+            ring = clip(ring, inside, intersect)
+            if not ring:
+                return 0.0
+        return abs(sum(ax*by-bx*ay for (ax,ay),(bx,by) in zip(ring, ring[1:]+ring[:1]))) / 2.0
+
+    def check(rings, fillrule, width=10, height=10):
+        img = pydraw.Image(width, height, background=(255,255,255))
+        img.drawpolygon(rings[0], holes=rings[1:], fillcolor=(0,0,0), fillrule=fillrule)
+        for py in range(height):
+            for px in range(width):
+                expected = pixelarea(rings[0], px, py) - sum(pixelarea(hole, px, py) for hole in rings[1:])
+                measured = (255 - img.imagegrid[py][px][0]) / 255.0
+                assert abs(measured - expected) < 0.02, "pixel %s,%s of %s is %.3f, not %.3f" % (px, py, rings, measured, expected)
+
+    rand = random.Random(47)
+    for _ in range(100):
+        #triangles with one vertex off the left, right, top or bottom edge
+        inner = [(rand.uniform(1,9), rand.uniform(1,9)) for _ in range(2)]
+        check([inner + [(rand.uniform(-8,-1), rand.uniform(0,10))]], "evenodd")
+        check([inner + [(rand.uniform(11,18), rand.uniform(0,10))]], "evenodd")
+        check([inner + [(rand.uniform(0,10), rand.uniform(-8,-1))]], "evenodd")
+        check([inner + [(rand.uniform(0,10), rand.uniform(11,18))]], "evenodd")
+    #a square reaching off both sides with a hole, wound both ways for nonzero
+    exterior = [(-3.3,1.2),(12.6,0.7),(13.1,8.6),(-2.8,9.1)]
+    hole = [(2.2,3.1),(7.6,2.7),(6.9,6.4),(2.6,6.8)]
+    for fillrule in ("evenodd","nonzero"):
+        check([exterior, hole], fillrule)
+        check([exterior, hole[::-1]], fillrule)
+
+
+def _roundtrip(img, extension, mode="RGB"):
+    """
+    Saves an image to a temporary file with the given extension and loads it again.
+    """
+
+    import os, shutil, tempfile
+    import pydraw
+
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "roundtrip" + extension)
+        img.save(path)
+        return pydraw.Image(filepath=path, mode=mode)
+    finally:
+        shutil.rmtree(folder)
+
+
+def testgif():
+    """
+    Checks that the GIF writer and reader give back the pixels that were saved,
+    with enough colors and pixels that the LZW codes grow to their full width
+    and the code table is cleared, and that more than 256 colors are reduced
+    to close palette colors. Raises an AssertionError if not.
+    """
+
+    import random
+    import pydraw
+    from pydraw._fileformats import gif
+
+    rand = random.Random(28)
+    #the LZW codec alone, with the smallest and the largest code sizes
+    for mincodesize in (2,8):
+        indices = [rand.randrange(1 << mincodesize) for _ in range(20000)]
+        compressed = gif.lzw_encode(indices, mincodesize).tostring()
+        assert [ord(char) for char in gif.lzw_decode(compressed, mincodesize)] == indices, "LZW round trip failed for code size %s" % mincodesize
+
+    #200 colors in random order, whose strings fill the code table several times
+    palette = [(rand.randrange(256), rand.randrange(256), rand.randrange(256)) for _ in range(200)]
+    data = [[rand.choice(palette) for _ in range(131)] for _ in range(97)]
+    loaded = _roundtrip(pydraw.Image(data=[list(row) for row in data]), ".gif")
+    assert (loaded.width, loaded.height) == (131, 97)
+    assert [[tuple(color) for color in row] for row in loaded.imagegrid] == data, "GIF pixels changed"
+
+    #a gradient of 4096 colors, reduced to a palette
+    data = [[(x*4, y*4, (x+y)*2) for x in range(64)] for y in range(64)]
+    loaded = _roundtrip(pydraw.Image(data=[list(row) for row in data]), ".gif")
+    colors = set()
+    for row,loadedrow in zip(data, loaded.imagegrid):
+        for color,loadedcolor in zip(row, loadedrow):
+            colors.add(tuple(loadedcolor))
+            assert max(abs(a-b) for a,b in zip(color, loadedcolor)) <= 32, "quantized %s to %s" % (color, tuple(loadedcolor))
+    assert len(colors) <= 256
+
+    #transparency, pixels with alpha below 128 become fully transparent
+    img = pydraw.Image(5, 3, mode="RGBA", background=(0,0,0,0))
+    img.imagegrid[1][2] = (200,100,50,255)
+    img.imagegrid[2][4] = (30,30,30,100)
+    loaded = _roundtrip(img, ".gif", mode="RGBA")
+    assert tuple(loaded.imagegrid[1][2]) == (200,100,50,255)
+    assert tuple(loaded.imagegrid[2][4])[3] == 0 and tuple(loaded.imagegrid[0][0])[3] == 0
+
+
+def testbmp():
+    """
+    Checks that the BMP writer and reader give back the pixels that were saved,
+    with a width whose rows need padding and rows that all differ, so that
+    the bottom-up row order is checked too. Raises an AssertionError if not.
+    """
+
+    import pydraw
+
+    #13 pixels of 3 or 4 bytes are never a multiple of 4 bytes
+    data = [[(x*19 % 256, y*23 % 256, (x*y) % 256) for x in range(13)] for y in range(7)]
+    loaded = _roundtrip(pydraw.Image(data=[list(row) for row in data]), ".bmp")
+    assert (loaded.width, loaded.height) == (13, 7)
+    assert [[tuple(color) for color in row] for row in loaded.imagegrid] == data, "BMP pixels changed"
+
+    #with transparency, fully opaque and fully transparent pixels so that premultiplying is exact
+    img = pydraw.Image(13, 7, mode="RGBA", background=(0,0,0,0))
+    for y in range(7):
+        img.imagegrid[y][y] = (y*30, 255-y*30, 7, 255)
+    loaded = _roundtrip(img, ".bmp", mode="RGBA")
+    assert [[tuple(color) for color in row] for row in loaded.imagegrid] == img.imagegrid, "BMP transparent pixels changed"
+
+
+def testpnm():
+    """
+    Checks that PPM and PAM files are saved and loaded without changing the pixels,
+    and that files from other programs with other maxvals, 16 bit samples and
+    greyscale PAM headers are loaded and scaled to 8 bits. Raises an AssertionError if not.
+    """
+
+    import os, shutil, struct, tempfile
+    import pydraw
+
+    data = [[(x*19 % 256, y*23 % 256, (x*y) % 256) for x in range(13)] for y in range(7)]
+    for extension in (".ppm",".pam"):
+        loaded = _roundtrip(pydraw.Image(data=[list(row) for row in data]), extension)
+        assert [[tuple(color) for color in row] for row in loaded.imagegrid] == data, "%s pixels changed" % extension
+    img = pydraw.Image(13, 7, mode="RGBA", background=(0,0,0,0))
+    for y in range(7):
+        img.imagegrid[y][y] = (y*30, 255-y*30, 7, 255)
+    loaded = _roundtrip(img, ".pam", mode="RGBA")
+    assert [[tuple(color) for color in row] for row in loaded.imagegrid] == img.imagegrid, "PAM transparent pixels changed"
+
+    folder = tempfile.mkdtemp()
+    try:
+        def load(filename, content):
+            path = os.path.join(folder, filename)
+            with open(path, "wb") as fileobj:
+                fileobj.write(content)
+            return [[tuple(color) for color in row] for row in pydraw.Image(filepath=path).imagegrid]
+        #16 bit samples, big endian, with a maxval of 1000
+        values = [0, 500, 1000, 1000, 0, 250]
+        content = b"P6\n2 1\n1000\n" + struct.pack(">6H", *values)
+        assert load("wide.ppm", content) == [[(0,127,255),(255,0,63)]]
+        #greyscale with a maxval of 15
+        content = b"P5 3 1 15\n" + struct.pack("3B", 0, 5, 15)
+        assert load("grey.ppm", content) == [[(0,0,0),(85,85,85),(255,255,255)]]
+        #greyscale with alpha as a PAM, whose alpha is dropped in RGB mode
+        content = (b"P7\nWIDTH 2\nHEIGHT 2\nDEPTH 2\nMAXVAL 255\nTUPLTYPE GRAYSCALE_ALPHA\nENDHDR\n"
+                   + struct.pack("8B", 10, 255, 20, 0, 30, 128, 40, 255))
+        assert load("grey.pam", content) == [[(10,10,10),(20,20,20)],[(30,30,30),(40,40,40)]]
+    finally:
+        shutil.rmtree(folder)
+
+
+def testdrawtiled():
+    """
+    Checks that drawing thick multilines and outlined polygons with drawtiled
+    gives the same pixels as drawing them directly, up to one color step of
+    rounding, also where sharp miter joins reach into neighbouring tiles.
+    Raises an AssertionError if not.
+    """
+
+    import random
+    import pydraw
+
+    rand = random.Random(1)
+    calls = []
+    for _ in range(6):
+        coords = [(rand.uniform(0,200), rand.uniform(0,200)) for _ in range(5)]
+        calls.append(("drawmultiline", dict(coords=coords, fillsize=rand.uniform(4,14), fillcolor=(200,30,30,200))))
+    calls.append(("drawpolygon", dict(coords=[(20,20),(180,30),(32,169)], fillcolor=(0,0,200), outlinecolor=(0,0,0), outlinewidth=8)))
+    calls.append(("drawline", dict(x1=5, y1=190, x2=195, y2=150, fillsize=1)))
+    def copied(options):
+        #drawing may change the coordinate lists
+        if "coords" in options:
+            return dict(options, coords=list(options["coords"]))
+        return dict(options)
+    for mode in ("RGB","RGBA"):
+        for processes in (1,2):
+            direct = pydraw.Image(200, 200, mode=mode)
+            for methodname,options in calls:
+                getattr(direct, methodname)(**copied(options))
+            tiled = pydraw.Image(200, 200, mode=mode)
+            tiled.drawtiled([(methodname, copied(options)) for methodname,options in calls], tilesize=32, processes=processes)
+            for y in range(200):
+                for x in range(200):
+                    difference = max(abs(a-b) for a,b in zip(direct.imagegrid[y][x], tiled.imagegrid[y][x]))
+                    assert difference <= 1, "%s pixel %s,%s is %s tiled, not %s" % (mode, x, y, tiled.imagegrid[y][x], direct.imagegrid[y][x])
+
+
+def testencodestream():
+    """
+    Checks that iterencode yields each format in several pieces that join to a
+    file with the same pixels, that encoded pieces waiting for a slow consumer
+    pause the encoding, and that encode_async streams the pieces and limits how
+    many jobs wait when an asyncio module is available. Raises an AssertionError if not.
+    """
+
+    import os, shutil, tempfile, threading, Queue
+    import pydraw
+    from pydraw import core
+
+    #every format in pieces, with a last band that is not full
+    rgb = pydraw.Image(37, 150)
+    rgb.drawcircle(18, 75, fillsize=15, fillcolor=(200,100,0))
+    rgba = pydraw.Image(37, 150, mode="RGBA", background=(0,0,0,0))
+    rgba.drawrectangle([4,4,30,140], fillcolor=(0,100,200,255))
+    folder = tempfile.mkdtemp()
+    try:
+        for img,formats in ((rgb, ("png","bmp","ppm","pam")), (rgba, ("png","bmp","pam"))):
+            for fileformat in formats:
+                pieces = list(img.iterencode(fileformat, bandheight=16))
+                assert len(pieces) >= 10, "%s came in %s pieces" % (fileformat, len(pieces))
+                path = os.path.join(folder, "stream." + fileformat)
+                with open(path, "wb") as fileobj:
+                    fileobj.write(b"".join(pieces))
+                loaded = pydraw.Image(filepath=path, mode=img.mode)
+                assert [[tuple(color) for color in row] for row in loaded.imagegrid] == img.imagegrid, "%s %s pixels changed" % (img.mode, fileformat)
+    finally:
+        shutil.rmtree(folder)
+
+    #a slow consumer, the event loop is stood in for by a queue of callbacks run here
+    class QueueLoop(object):
+        def __init__(self):
+            self.calls = Queue.Queue()
+        def call_soon_threadsafe(self, func, *args):
+            self.calls.put((func, args))
+    loop = QueueLoop()
+    received = []
+    fileobj = core._ChunkWriter(loop, received.append)
+    encoder = threading.Thread(target=lambda: [fileobj.write(data) for data in rgb.iterencode("ppm", bandheight=8)])
+    encoder.start()
+    while encoder.is_alive() or not loop.calls.empty():
+        encoder.join(0.05)
+        assert loop.calls.qsize() <= core.ASYNC_MAXCHUNKS, "%s pieces piled up" % loop.calls.qsize()
+        if not loop.calls.empty():
+            func,args = loop.calls.get()
+            func(*args)
+    assert b"".join(received) == b"".join(rgb.iterencode("ppm")) and fileobj.size == len(b"".join(received))
+
+    try:
+        asyncio = core._importasyncio()
+    except ImportError:
+        print "no asyncio or trollius module, encode_async not checked"
+        return
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        received = []
+        size = loop.run_until_complete(rgb.encode_async("png", onchunk=received.append))
+        assert size == len(b"".join(received)) and len(received) == 4
+        assert b"".join(received) == loop.run_until_complete(rgb.encode_async("png"))
+        #jobs beyond the running and waiting limits are refused
+        oldlimits = core.ASYNC_MAXJOBS, core.ASYNC_MAXWAITING
+        core.ASYNC_MAXJOBS, core.ASYNC_MAXWAITING = 1, 1
+        try:
+            futures = [rgb.encode_async("bmp"), rgb.encode_async("bmp")]
+            try:
+                rgb.encode_async("bmp")
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError("a third job was accepted")
+            loop.run_until_complete(asyncio.gather(*futures))
+        finally:
+            core.ASYNC_MAXJOBS, core.ASYNC_MAXWAITING = oldlimits
+        assert core._asyncjobs["running"] == 0 and not core._asyncjobs["waiting"]
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
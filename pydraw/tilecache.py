@@ -0,0 +1,148 @@
+# Pydraw submodule
+# Cache for rendered and encoded map tiles
+
+import os,io,hashlib,collections
+from core import Image
+from coordinate_transformer import CoordinateSystem
+
+
+class TileCache(object):
+    def __init__(self, maxmemory=64*1024*1024, folder=None, maxdisk=1024*1024*1024):
+        """
+        A cache of rendered tiles, kept as PNG file bytes, so that repeated
+        requests for the same tile of the same drawing are neither drawn
+        nor encoded again.
+
+        Tiles are kept in memory, and optionally also in a folder on disk.
+        When a size budget is full the least recently used tiles are removed.
+        Tiles that are removed from memory stay on disk if a folder is given.
+
+        | **option** | **description**
+        | --- | ---
+        | *maxmemory | the maximum number of bytes of tiles to keep in memory, default is 64 MB
+        | *folder | the string path of a folder to also keep tiles in, created if it doesn't exist. Default is not to use the disk.
+        | *maxdisk | the maximum number of bytes of tiles to keep in the folder, default is 1 GB
+
+        """
+        self.maxmemory = maxmemory
+        self.maxdisk = maxdisk
+        self.folder = folder
+        self._memory = collections.OrderedDict()
+        self._memorysize = 0
+        self._disk = collections.OrderedDict()
+        self._disksize = 0
+        self._stats = dict(memoryhits=0, diskhits=0, misses=0)
+        if folder:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            #pick up tiles from earlier runs, least recently used first
+            filenames = [filename for filename in os.listdir(folder) if filename.endswith(".png")]
+            filenames.sort(key=lambda filename: os.path.getmtime(os.path.join(folder, filename)))
+            for filename in filenames:
+                size = os.path.getsize(os.path.join(folder, filename))
+                self._disk[filename[:-4]] = size
+                self._disksize += size
+            self._evictdisk()
+
+    def render(self, displaylist, bbox, width, height, background=None):
+        """
+        Get the PNG file bytes of a display list drawn onto a tile,
+        drawing and encoding it only if it is not already cached.
+
+        | **option** | **description**
+        | --- | ---
+        | displaylist | the DisplayList instance to draw
+        | bbox | the coordinate bbox of the tile as a four-tuple (xleft,ytop,xright,ybottom)
+        | width/height | the size of the tile in pixels
+        | *background | an RGB color tuple for the tile background, default as for Image
+
+        """
+        key = (displaylist.contenthash(), tuple(bbox), width, height, background)
+        key = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        data = self.get(key)
+        if data is None:
+            img = Image(width, height, background=background, crs=CoordinateSystem(bbox))
+            displaylist.replay(img)
+            data = _encodepng(img)
+            self.put(key, data)
+        return data
+
+    def get(self, key):
+        """
+        Get the cached bytes for a string key, or None if not cached.
+        """
+        if key in self._memory:
+            self._stats["memoryhits"] += 1
+            data = self._memory.pop(key)
+            self._memory[key] = data
+            return data
+        if key in self._disk:
+            self._stats["diskhits"] += 1
+            size = self._disk.pop(key)
+            self._disk[key] = size
+            path = os.path.join(self.folder, key+".png")
+            with open(path, "rb") as fileobj:
+                data = fileobj.read()
+            os.utime(path, None)
+            self._putmemory(key, data)
+            return data
+        self._stats["misses"] += 1
+        return None
+
+    def put(self, key, data):
+        """
+        Cache some bytes, eg an encoded tile, under a string key.
+        """
+        self._putmemory(key, data)
+        if self.folder and key not in self._disk:
+            with open(os.path.join(self.folder, key+".png"), "wb") as fileobj:
+                fileobj.write(data)
+            self._disk[key] = len(data)
+            self._disksize += len(data)
+            self._evictdisk()
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of memory hits, disk hits and misses
+        so far, and the number of tiles and bytes currently cached in memory and on disk.
+        """
+        stats = dict(self._stats)
+        stats.update(memorytiles=len(self._memory), memorysize=self._memorysize,
+                     disktiles=len(self._disk), disksize=self._disksize)
+        return stats
+
+    def clear(self):
+        """
+        Removes all tiles from memory and disk, and resets the statistics.
+        """
+        for key in self._disk:
+            os.remove(os.path.join(self.folder, key+".png"))
+        self._memory.clear()
+        self._memorysize = 0
+        self._disk.clear()
+        self._disksize = 0
+        self._stats = dict(memoryhits=0, diskhits=0, misses=0)
+
+    #INTERNAL USE ONLY
+    def _putmemory(self, key, data):
+        if key in self._memory:
+            self._memorysize -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memorysize += len(data)
+        while self._memorysize > self.maxmemory and self._memory:
+            _,olddata = self._memory.popitem(last=False)
+            self._memorysize -= len(olddata)
+    def _evictdisk(self):
+        while self._disksize > self.maxdisk and self._disk:
+            oldkey,size = self._disk.popitem(last=False)
+            self._disksize -= size
+            os.remove(os.path.join(self.folder, oldkey+".png"))
+
+def _encodepng(img):
+    """
+    Encodes an image as PNG file bytes.
+    For internal use only.
+    """
+    fileobj = io.BytesIO()
+    img._encode(fileobj, "png")
+    return fileobj.getvalue()